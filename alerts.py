@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+
+DEFAULT_ALERT_INTERVAL = 300
+MIN_ALERT_INTERVAL = 60
+MAX_ALERT_INTERVAL = 7 * 24 * 3600
+RULE_KINDS = ("move", "drift")
+
+
+@dataclass
+class Quotes:
+    """Price and allocation of every watched symbol at one tick, as parallel arrays."""
+
+    symbols: list[str]
+    price: np.ndarray
+    allocation: np.ndarray
+    currency: list[str]
+
+    def __post_init__(self):
+        self._index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    def positions(self, symbols: list[str]) -> np.ndarray:
+        """Index of each symbol in the arrays, or -1 if it is not quoted."""
+        return np.fromiter((self._index.get(symbol, -1) for symbol in symbols), dtype=int, count=len(symbols))
+
+    def take(self, values: np.ndarray, symbols: list[str]) -> np.ndarray:
+        index = self.positions(symbols)
+        return np.where(index >= 0, values[index], np.nan)
+
+
+class StateArray:
+    """Per-key float state in one array, read and written for many keys at once."""
+
+    def __init__(self, default: float = np.nan):
+        self.default = default
+        self._index: dict = {}
+        self._values = np.empty(0)
+
+    def get(self, keys: list) -> np.ndarray:
+        index = np.fromiter((self._index.get(key, -1) for key in keys), dtype=int, count=len(keys))
+        return np.where(index >= 0, self._values[index] if len(self._values) else self.default, self.default)
+
+    def set(self, keys: list, values: np.ndarray):
+        new = [key for key in dict.fromkeys(keys) if key not in self._index]
+        if new:
+            self._index.update({key: len(self._index) + i for i, key in enumerate(new)})
+            self._values = np.concatenate([self._values, np.full(len(new), self.default)])
+        self._values[[self._index[key] for key in keys]] = values
+
+
+async def fetch_quotes(ghost, extra: dict[str, str]) -> Quotes:
+    """One holdings request for everything held, plus market data for watched symbols not held.
+
+    ``extra`` maps such symbols to their data source.
+    """
+    holdings = (await ghost.holdings()).get("holdings", [])
+    held = {holding["symbol"] for holding in holdings}
+    missing = [symbol for symbol in extra if symbol not in held]
+
+    async def latest(symbol: str):
+        try:
+            points = (await ghost.market_data(extra[symbol], symbol)).get("marketData") or []
+        except Exception as e:
+            logging.warning("No market data for %s: %s", symbol, e)
+            return None
+        return points[-1]["marketPrice"] if points else None
+
+    prices = await asyncio.gather(*(latest(symbol) for symbol in missing))
+    symbols = [holding["symbol"] for holding in holdings] + missing
+    return Quotes(
+        symbols=symbols,
+        price=np.array([holding.get("marketPrice") for holding in holdings] + prices, dtype=float),
+        allocation=np.array([holding.get("allocationInPercentage") or 0 for holding in holdings] + [0] * len(missing), dtype=float),
+        currency=[holding.get("currency", "") for holding in holdings] + [""] * len(missing),
+    )
+
+
+class AlertBook:
+    """A chat's alert rules and the state needed to report only changes.
+
+    Rules are dicts: ``{"kind": "move", "symbol": "AAPL" or "*", "threshold": 0.05}``
+    fires when the price moved by threshold since the last alert (or since the rule
+    was added); ``{"kind": "drift", "symbol": "AAPL", "target": 0.2, "tolerance": 0.05}``
+    fires when the allocation leaves or returns to target +/- tolerance.
+    """
+
+    def __init__(self, credentials: tuple[str, str], interval: int = DEFAULT_ALERT_INTERVAL):
+        self.credentials = credentials
+        self.interval = interval
+        self.rules: list[dict] = []
+        self._reference = StateArray()
+        self._band = StateArray(default=0.0)
+        self._previous: Quotes | None = None
+
+    def add(self, rule: dict):
+        self.rules.append(rule)
+        # Evaluate the new rule on the next tick even if prices did not change.
+        self._previous = None
+
+    def clear(self):
+        self.rules.clear()
+        self._reference = StateArray()
+        self._band = StateArray(default=0.0)
+        self._previous = None
+
+    def watched(self) -> dict[str, str]:
+        return {rule["symbol"]: rule.get("data_source", "YAHOO") for rule in self.rules if rule["symbol"] != "*"}
+
+    def _pairs(self, kind: str, quotes: Quotes) -> tuple[list[tuple[int, str]], list[dict]]:
+        pairs, rules = [], []
+        for i, rule in enumerate(self.rules):
+            if rule["kind"] != kind:
+                continue
+            for symbol in quotes.symbols if rule["symbol"] == "*" else [rule["symbol"]]:
+                pairs.append((i, symbol))
+                rules.append(rule)
+        return pairs, rules
+
+    def _moves(self, quotes: Quotes) -> list[str]:
+        pairs, rules = self._pairs("move", quotes)
+        if not pairs:
+            return []
+        symbols = [symbol for _, symbol in pairs]
+        price = quotes.take(quotes.price, symbols)
+        reference = self._reference.get(pairs)
+        threshold = np.array([rule["threshold"] for rule in rules])
+
+        change = price / reference - 1
+        fired = np.abs(change) >= threshold
+        # The price an alert fired at (or the first one seen) is the reference for the next move.
+        self._reference.set(pairs, np.where(fired | np.isnan(reference), price, reference))
+
+        index = quotes.positions(symbols)
+        return [
+            f"{symbols[i]} moved {change[i] * 100:+.2f}% to {price[i]:.6g} "
+            f"{quotes.currency[index[i]]} (alert at {threshold[i] * 100:g}%)"
+            for i in np.flatnonzero(fired)
+        ]
+
+    def _drifts(self, quotes: Quotes) -> list[str]:
+        pairs, rules = self._pairs("drift", quotes)
+        if not pairs:
+            return []
+        symbols = [symbol for _, symbol in pairs]
+        allocation = np.nan_to_num(quotes.take(quotes.allocation, symbols))
+        target = np.array([rule["target"] for rule in rules])
+        tolerance = np.array([rule["tolerance"] for rule in rules])
+
+        band = np.sign(allocation - target) * (np.abs(allocation - target) > tolerance)
+        changed = band != self._band.get(pairs)
+        self._band.set(pairs, band)
+
+        messages = []
+        for i in np.flatnonzero(changed):
+            where = {1: "above", -1: "below", 0: "back within"}[int(band[i])]
+            messages.append(f"{symbols[i]} allocation {allocation[i] * 100:.2f}% is {where} "
+                            f"target {target[i] * 100:g}% ± {tolerance[i] * 100:g}%")
+        return messages
+
+    def evaluate(self, quotes: Quotes) -> list[str]:
+        """Messages for every rule whose state changed since the previous tick."""
+        previous, self._previous = self._previous, quotes
+        if (previous is not None and previous.symbols == quotes.symbols
+                and np.array_equal(previous.price, quotes.price, equal_nan=True)
+                and np.array_equal(previous.allocation, quotes.allocation)):
+            return []
+        return self._moves(quotes) + self._drifts(quotes)
+
+    async def check(self, ghost) -> list[str]:
+        return self.evaluate(await fetch_quotes(ghost, self.watched()))
@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from tasks import SingleFlight
+
+BASE_CURRENCY = os.getenv("BASE_CURRENCY", "TWD")
+DEFAULT_ANALYTICS_TTL = 3600
+# Ask Ghostfolio for new orders at most this often; invalidate() forces the next sync.
+DEFAULT_SYNC_INTERVAL = 60
+DEFAULT_RANGES = ("wtd", "mtd", "ytd", "1y", "5y", "max")
+# Daily grid includes weekends, on which prices are carried forward.
+DAYS_PER_YEAR = 365
+
+# Sign of the external cash flow each order type causes; BUY/SELL also move the quantity held.
+FLOW_SIGNS = {"BUY": 1, "SELL": -1, "DIVIDEND": -1, "INTEREST": -1, "FEE": 1}
+
+
+@dataclass
+class PortfolioArrays:
+    """Daily (symbol x day) arrays in base currency, from which every range is a slice.
+
+    ``flows`` are external cash flows into each position: purchases and fees are
+    positive, sales and income paid out are negative. Day 0 is the day before the
+    first order, when nothing was held.
+    """
+
+    dates: np.ndarray
+    symbols: list[str]
+    value: np.ndarray
+    flows: np.ndarray
+    cumulative_flows: np.ndarray
+    total_value: np.ndarray
+    total_flows: np.ndarray
+    returns: np.ndarray
+    log_growth: np.ndarray
+    excluded: list[str]
+
+
+def range_bounds(date_range: str, today: np.datetime64) -> tuple[np.datetime64 | None, np.datetime64]:
+    """First and last day of a Ghostfolio style range: wtd, mtd, ytd, 1y, 5y, max or a year."""
+    year = today.astype("datetime64[Y]")
+    if date_range == "max":
+        return None, today
+    if date_range == "ytd":
+        return year.astype("datetime64[D]"), today
+    if date_range == "mtd":
+        return today.astype("datetime64[M]").astype("datetime64[D]"), today
+    if date_range == "wtd":
+        # 1970-01-01 was a Thursday, so Monday is 3 days after a multiple of 7 days.
+        return today - (today.astype(int) - 4) % 7, today
+    if date_range.endswith("y") and date_range[:-1].isdigit():
+        return today - int(date_range[:-1]) * DAYS_PER_YEAR, today
+    if date_range.isdigit():
+        start = np.datetime64(f"{date_range}-01-01")
+        return start, min(np.datetime64(f"{date_range}-12-31"), today)
+    raise ValueError(f"Unknown range {date_range}")
+
+
+def _fill(dates: np.ndarray, observed_dates: np.ndarray, observed: np.ndarray) -> np.ndarray:
+    """Values on every grid day: the last observation, or the first one before any exist."""
+    out = np.full(len(dates), np.nan)
+    if not len(observed):
+        return out
+    order = np.argsort(observed_dates, kind="stable")
+    index = np.searchsorted(dates, observed_dates[order])
+    inside = (index >= 0) & (index < len(dates))
+    out[index[inside]] = observed[order][inside]
+    out[0] = out[0] if not np.isnan(out[0]) else observed[order][0]
+    # Forward fill by carrying the index of the last observed day.
+    last = np.where(~np.isnan(out), np.arange(len(out)), 0)
+    np.maximum.accumulate(last, out=last)
+    return out[last]
+
+
+def _market_series(resp: dict) -> tuple[np.ndarray, np.ndarray]:
+    points = resp.get("marketData") or []
+    dates = np.array([point["date"][:10] for point in points], dtype="datetime64[D]")
+    prices = np.fromiter((point["marketPrice"] for point in points), dtype=float, count=len(points))
+    return dates, prices
+
+
+def build_arrays(activities: list[dict], market_data: dict[str, dict], fx: dict[str, dict | None],
+                 base_currency: str, today: np.datetime64) -> PortfolioArrays:
+    """Turn orders and market data responses into PortfolioArrays.
+
+    ``market_data`` maps symbol to its admin market data response (or {} when
+    unavailable, then order prices are used); ``fx`` maps currency to the market
+    data of the currency/base pair, or None when it could not be loaded.
+    """
+    activities = [activity for activity in activities if activity["type"] in FLOW_SIGNS]
+    missing_fx = {currency for currency, resp in fx.items() if resp is None}
+    excluded = sorted({a["SymbolProfile"]["symbol"] for a in activities if a["SymbolProfile"]["currency"] in missing_fx})
+    activities = [a for a in activities if a["SymbolProfile"]["symbol"] not in excluded]
+
+    symbols = sorted({activity["SymbolProfile"]["symbol"] for activity in activities})
+    if not symbols:
+        dates = np.array([today], dtype="datetime64[D]")
+        zeros = np.zeros((0, 1))
+        return PortfolioArrays(dates, [], zeros, zeros, zeros, np.zeros(1), np.zeros(1), np.zeros(1), np.zeros(1), excluded)
+
+    order_dates = np.array([activity["date"][:10] for activity in activities], dtype="datetime64[D]")
+    dates = np.arange(order_dates.min() - 1, today + 1, dtype="datetime64[D]")
+    row = {symbol: i for i, symbol in enumerate(symbols)}
+    rows = np.fromiter((row[activity["SymbolProfile"]["symbol"]] for activity in activities), dtype=int, count=len(activities))
+    days = np.searchsorted(dates, order_dates)
+    types = np.array([activity["type"] for activity in activities])
+    quantity = np.fromiter((activity["quantity"] for activity in activities), dtype=float, count=len(activities))
+    unit_price = np.fromiter((activity["unitPrice"] for activity in activities), dtype=float, count=len(activities))
+    fee = np.fromiter((activity.get("fee") or 0 for activity in activities), dtype=float, count=len(activities))
+    sign = np.fromiter((FLOW_SIGNS[kind] for kind in types), dtype=float, count=len(activities))
+    trades = np.isin(types, ("BUY", "SELL"))
+
+    # Exchange rate of each symbol's currency into base currency, per day.
+    currencies = {symbol: None for symbol in symbols}
+    for activity in activities:
+        currencies[activity["SymbolProfile"]["symbol"]] = activity["SymbolProfile"]["currency"]
+    rates = {base_currency: np.ones(len(dates))}
+    for currency, resp in fx.items():
+        if resp is not None:
+            rates[currency] = _fill(dates, *_market_series(resp))
+    fx_matrix = np.stack([rates.get(currencies[symbol], np.ones(len(dates))) for symbol in symbols])
+
+    # Prices: market data where available, order prices fill the gaps.
+    prices = np.empty((len(symbols), len(dates)))
+    for symbol, i in row.items():
+        mine = (rows == i) & trades
+        market_dates, market_prices = _market_series(market_data.get(symbol) or {})
+        prices[i] = _fill(dates, np.concatenate([order_dates[mine], market_dates]),
+                          np.concatenate([unit_price[mine], market_prices]))
+    prices = np.nan_to_num(prices) * fx_matrix
+
+    held = np.zeros((len(symbols), len(dates)))
+    np.add.at(held, (rows, days), np.where(trades, sign * quantity, 0))
+    np.cumsum(held, axis=1, out=held)
+
+    amount = np.where(types == "FEE", fee, quantity * unit_price + np.where(trades, sign * fee, 0))
+    flows = np.zeros((len(symbols), len(dates)))
+    np.add.at(flows, (rows, days), sign * amount * fx_matrix[rows, days])
+
+    value = held * prices
+    total_value = value.sum(axis=0)
+    total_flows = flows.sum(axis=0)
+    # Money added counts from the start of the day and money taken out until its end,
+    # so buying in or selling out completely on a day is not itself a return.
+    invested = np.concatenate([[0.0], total_value[:-1]]) + np.maximum(total_flows, 0)
+    ending = total_value - np.minimum(total_flows, 0)
+    returns = np.divide(ending, invested, out=np.ones(len(dates)), where=invested > 0) - 1
+    log_growth = np.cumsum(np.log1p(np.maximum(returns, -0.999999)))
+
+    return PortfolioArrays(dates, symbols, value, flows, np.cumsum(flows, axis=1), total_value, total_flows,
+                           returns, log_growth, excluded)
+
+
+def xirr(days: np.ndarray, amounts: np.ndarray, guess: float = 0.1) -> float:
+    """Annual rate at which the net present value of amounts received on days is zero."""
+    if not (amounts > 0).any() or not (amounts < 0).any():
+        return float("nan")
+    years = (days - days[0]) / DAYS_PER_YEAR
+
+    def npv(rate):
+        return np.sum(amounts / (1 + rate) ** years)
+
+    rate = guess
+    for _ in range(50):
+        discount = (1 + rate) ** years
+        value = np.sum(amounts / discount)
+        slope = np.sum(-years * amounts / (discount * (1 + rate)))
+        if slope == 0:
+            break
+        step = value / slope
+        rate -= step
+        if rate <= -1:
+            break
+        if abs(step) < 1e-10:
+            return float(rate)
+
+    # Newton did not converge; bisect, which works whenever the NPV changes sign.
+    low, high = -0.9999, 1.0
+    while npv(high) > 0 and high < 1e6:
+        high *= 10
+    if np.sign(npv(low)) == np.sign(npv(high)):
+        return float("nan")
+    for _ in range(200):
+        mid = (low + high) / 2
+        if np.sign(npv(mid)) == np.sign(npv(low)):
+            low = mid
+        else:
+            high = mid
+    return float((low + high) / 2)
+
+
+def range_slice(arrays: PortfolioArrays, date_range: str) -> tuple[int, int]:
+    """Indices (a, b): value at day a is the starting value, days a+1..b are inside the range."""
+    start, end = range_bounds(date_range, arrays.dates[-1])
+    b = max(int(np.searchsorted(arrays.dates, end, side="right")) - 1, 0)
+    a = 0 if start is None else min(max(int(np.searchsorted(arrays.dates, start)) - 1, 0), b)
+    return a, b
+
+
+def range_metrics(arrays: PortfolioArrays, date_range: str) -> dict:
+    a, b = range_slice(arrays, date_range)
+    returns = arrays.returns[a + 1:b + 1]
+    growth = np.exp(arrays.log_growth[a:b + 1] - arrays.log_growth[a])
+    drawdown = growth / np.maximum.accumulate(growth) - 1
+
+    flow_days = np.flatnonzero(arrays.total_flows[a + 1:b + 1]) + a + 1
+    days = np.concatenate([[a], flow_days, [b]]).astype(float)
+    amounts = np.concatenate([[-arrays.total_value[a]], -arrays.total_flows[flow_days], [arrays.total_value[b]]])
+
+    return {
+        "range": date_range,
+        "start": str(arrays.dates[a + 1] if b > a else arrays.dates[a]),
+        "end": str(arrays.dates[b]),
+        "twr": float(growth[-1] - 1),
+        "xirr": xirr(days, amounts),
+        "max_drawdown": float(drawdown.min()),
+        "volatility": float(returns.std() * np.sqrt(DAYS_PER_YEAR)) if len(returns) > 1 else 0.0,
+        "value": float(arrays.total_value[b]),
+        "profit": float(arrays.total_value[b] - arrays.total_value[a] - arrays.total_flows[a + 1:b + 1].sum()),
+    }
+
+
+def contributions(arrays: PortfolioArrays, date_range: str) -> list[tuple[str, float]]:
+    """Profit of each symbol over the range, largest first."""
+    a, b = range_slice(arrays, date_range)
+    profit = arrays.value[:, b] - arrays.value[:, a] - (arrays.cumulative_flows[:, b] - arrays.cumulative_flows[:, a])
+    order = np.argsort(-np.abs(profit))
+    return [(arrays.symbols[i], float(profit[i])) for i in order]
+
+
+class PortfolioAnalytics:
+    """Returns, risk and attribution computed locally from order history and market data.
+
+    The arrays are built once (orders from the OrderStore, prices from the admin
+    market data endpoint) and reused for every range until they are older than
+    ``ttl``, the stored orders change, or ``invalidate`` is called after an import.
+    New orders are looked for at most every ``sync_interval`` seconds.
+    """
+
+    def __init__(self, ghost, store, base_currency: str = BASE_CURRENCY, ttl: float = DEFAULT_ANALYTICS_TTL,
+                 sync_interval: float = DEFAULT_SYNC_INTERVAL):
+        self._ghost = ghost
+        self._store = store
+        self.base_currency = base_currency
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self._arrays: PortfolioArrays | None = None
+        self._built: float | None = None
+        self._synced: float | None = None
+        self._version: int | None = None
+        self._building = SingleFlight("build portfolio analytics")
+        self._generation = 0
+
+    async def _market_data(self, data_source: str, symbol: str) -> dict | None:
+        try:
+            return await self._ghost.market_data(data_source, symbol)
+        except Exception as e:
+            logging.warning("No market data for %s/%s: %s", data_source, symbol, e)
+            return None
+
+    async def _build(self) -> PortfolioArrays:
+        generation, version = self._generation, self._store.version
+        activities = await asyncio.to_thread(self._store.activities)
+        profiles = {activity["SymbolProfile"]["symbol"]: activity["SymbolProfile"] for activity in activities}
+        currencies = sorted({profile["currency"] for profile in profiles.values()} - {self.base_currency})
+
+        responses = await asyncio.gather(
+            *(self._market_data(profile.get("dataSource", "YAHOO"), symbol) for symbol, profile in profiles.items()),
+            *(self._market_data("YAHOO", f"{currency}{self.base_currency}") for currency in currencies),
+        )
+        market_data = {symbol: resp or {} for symbol, resp in zip(profiles, responses)}
+        fx = {currency: resp for currency, resp in zip(currencies, responses[len(profiles):])}
+
+        today = np.datetime64("today", "D")
+        arrays = await asyncio.to_thread(build_arrays, activities, market_data, fx, self.base_currency, today)
+        # A build that started before invalidate() may hold pre-import orders.
+        if generation == self._generation:
+            self._arrays, self._built, self._version = arrays, time.monotonic(), version
+        return arrays
+
+    async def _sync(self):
+        if self._synced is not None and time.monotonic() - self._synced < self.sync_interval:
+            return
+        await self._store.sync(self._ghost)
+        self._synced = time.monotonic()
+
+    async def arrays(self) -> PortfolioArrays:
+        await self._sync()
+        # The store also changes when /orders or an import syncs it.
+        if self._store.version != self._version or self._arrays is None or time.monotonic() - self._built > self.ttl:
+            # Concurrent callers share one build.
+            return await asyncio.shield(self._building.run(self._build))
+        return self._arrays
+
+    async def report(self, ranges=DEFAULT_RANGES, contribution_range: str = "1y") -> dict:
+        arrays = await self.arrays()
+        return {
+            "currency": self.base_currency,
+            "ranges": [range_metrics(arrays, date_range) for date_range in ranges],
+            "contributions": contributions(arrays, contribution_range),
+            "contribution_range": contribution_range,
+            "excluded": arrays.excluded,
+        }
+
+    def invalidate(self):
+        self._generation += 1
+        self._arrays = None
+        self._synced = None
+        self._building.clear()
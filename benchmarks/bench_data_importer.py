@@ -0,0 +1,76 @@
+"""Benchmark DataImporter on synthetic Cathay and Firstrade exports.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_data_importer --rows 100000 --output importer.json
+"""
+import argparse
+import io
+import random
+import time
+from datetime import date, timedelta
+
+from benchmarks import results
+from data_importer import DataImporter
+
+STOCK_MAP = {f"股票{i}": f"{1100 + i}.TW" for i in range(200)}
+
+
+def cathay_csv(rows: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    names = list(STOCK_MAP)
+    start = date(2010, 1, 1)
+    lines = ["國泰證券 對帳單", "日期,股名,買賣別,成交股數,成交價,手續費,交易稅"]
+    for _ in range(rows):
+        day = start + timedelta(days=rng.randrange(5000))
+        quantity = rng.randrange(1, 50) * 100
+        lines.append(
+            f'{day:%Y/%m/%d},{rng.choice(names)},{rng.choice(["現買", "現賣"])},"{quantity:,}",'
+            f'{rng.uniform(10, 1000):.2f},"{rng.randrange(20, 3000):,}",{rng.randrange(0, 500)}'
+        )
+    return "\n".join(lines) + "\n"
+
+
+def ft_csv(rows: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    symbols = ["AAPL", "MSFT", "VTI", "VOO", "TSLA", "NVDA", "GOOG", "AMZN"]
+    actions = ["BUY", "SELL", "Dividend", "Interest", "Other"]
+    start = date(2010, 1, 1)
+    lines = ["Symbol,Quantity,Price,Action,Description,TradeDate,SettledDate,Interest,Amount,Commission,Fee"]
+    for _ in range(rows):
+        day = start + timedelta(days=rng.randrange(5000))
+        action = rng.choice(actions)
+        quantity = rng.randrange(1, 100) * (-1 if action == "SELL" else 1)
+        lines.append(
+            f"{rng.choice(symbols)} ,{quantity},{rng.uniform(10, 500):.2f},{action},synthetic,"
+            f"{day:%Y-%m-%d},{day:%Y-%m-%d},0,{rng.uniform(-5000, 5000):.2f},0,{rng.uniform(0, 1):.2f}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def bench(broker: str, content: str, rows: int, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        file = io.StringIO(content)
+        start = time.perf_counter()
+        activities = DataImporter(broker, file, stock_map=STOCK_MAP).activities()
+        timings.append(time.perf_counter() - start)
+    return results.summarize(broker, timings, rows=rows, activities=len(activities))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON output file, stdout by default")
+    args = parser.parse_args()
+
+    output = [
+        bench(broker, content, args.rows, args.repeat)
+        for broker, content in (("cathay", cathay_csv(args.rows)), ("ft", ft_csv(args.rows)))
+    ]
+    results.write("data_importer", vars(args), output, args.output)
+
+
+if __name__ == "__main__":
+    main()
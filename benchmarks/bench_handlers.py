@@ -0,0 +1,163 @@
+"""Benchmark the bot handlers against a local Ghostfolio stand-in.
+
+Handlers are driven with a stubbed Telegram bot, so only the bot's own work and
+the (simulated) Ghostfolio latency are measured. Each handler is timed cold,
+on freshly built clients, caches and stores, and warm, after one untimed call.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_handlers --latency 50 --orders 5000 --output handlers.json
+"""
+import argparse
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+
+from benchmarks import results
+from benchmarks.fake_ghostfolio import FakeGhostfolio, load_fixtures, make_fixtures
+from charts import ChartRenderer
+from sessions import SessionPool
+import telegram_bot
+
+CHAT_ID = 1
+
+
+class StubBot:
+    """Records what the handlers send instead of talking to Telegram."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(("message", text))
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        self.sent.append(("photo", len(photo)))
+
+    async def send_document(self, chat_id, document, **kwargs):
+        self.sent.append(("document", document.filename))
+
+
+class StubMessage:
+    def __init__(self, bot: StubBot):
+        self._bot = bot
+
+    async def reply_text(self, text, **kwargs):
+        self._bot.sent.append(("message", text))
+
+
+class StubQuery:
+    def __init__(self, bot: StubBot, data: str):
+        self._bot = bot
+        self.data = data
+
+    async def answer(self):
+        pass
+
+    async def edit_message_text(self, text, **kwargs):
+        self._bot.sent.append(("edit", text))
+
+    async def edit_message_reply_markup(self, **kwargs):
+        pass
+
+
+def make_update(context, data: str | None = None):
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=CHAT_ID),
+        effective_user=SimpleNamespace(id=CHAT_ID),
+        message=StubMessage(context.bot),
+        callback_query=StubQuery(context.bot, data) if data is not None else None,
+    )
+
+
+def make_context(host: str, charts: ChartRenderer):
+    """Fresh bot_data wired like telegram_bot's __main__, on a new session pool and empty caches."""
+    charts.cache.clear()
+    bot_data = {
+        "sessions": SessionPool(db_path=":memory:", period_db_path=":memory:"),
+        "default_credentials": ("benchmark", host),
+        "default_users": None,
+        "charts": charts,
+    }
+    return SimpleNamespace(bot=StubBot(), bot_data=bot_data, chat_data={}, user_data={}, args=[])
+
+
+async def close_context(context):
+    await context.bot_data["sessions"].close()
+
+
+def scenarios(fixtures: dict) -> dict:
+    symbols = [holding["symbol"] for holding in fixtures["holdings"]["holdings"]]
+
+    async def orders(context):
+        await telegram_bot.order(make_update(context), context)
+        await telegram_bot.order_callback(make_update(context, "yes"), context)
+
+    return {
+        "accounts": lambda context: telegram_bot.accounts(make_update(context), context),
+        "holdings": lambda context: telegram_bot.holdings(make_update(context), context),
+        "performance": lambda context: telegram_bot.performance_callback(make_update(context, "max"), context),
+        "position": lambda context: telegram_bot.position_callback(make_update(context, symbols[len(symbols) // 2]), context),
+        "orders": orders,
+    }
+
+
+async def timed_run(scenario, context) -> float:
+    start = time.perf_counter()
+    await scenario(context)
+    return time.perf_counter() - start
+
+
+async def bench(server: FakeGhostfolio, fixtures: dict, repeat: int) -> list[dict]:
+    output = []
+    charts = ChartRenderer()
+    try:
+        # Start the render workers up front, so the first cold run does not pay for spawning them.
+        await charts.performance(fixtures["performance"]["chart"], "warmup", False)
+        for name, scenario in scenarios(fixtures).items():
+            cold = []
+            for _ in range(repeat):
+                context = make_context(server.url, charts)
+                cold.append(await timed_run(scenario, context))
+                await close_context(context)
+
+            context = make_context(server.url, charts)
+            await scenario(context)
+            requests = server.requests
+            warm = [await timed_run(scenario, context) for _ in range(repeat)]
+            warm_requests = (server.requests - requests) / repeat
+            await close_context(context)
+
+            output.append(results.summarize(f"{name}/cold", cold))
+            output.append(results.summarize(f"{name}/warm", warm, requests_per_run=warm_requests))
+    finally:
+        charts.close()
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", help="directory of recorded responses, instead of generated ones")
+    parser.add_argument("--holdings", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--chart-points", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=20, help="simulated Ghostfolio latency in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="extra random latency in ms")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="JSON output file, stdout by default")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.fixtures:
+        fixtures = load_fixtures(args.fixtures)
+    else:
+        fixtures = make_fixtures(args.holdings, args.orders, args.chart_points)
+
+    with FakeGhostfolio(fixtures, latency=args.latency / 1000, jitter=args.jitter / 1000) as server:
+        output = asyncio.run(bench(server, fixtures, args.repeat))
+    results.write("handlers", vars(args), output, args.output)
+
+
+if __name__ == "__main__":
+    main()
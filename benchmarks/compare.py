@@ -0,0 +1,32 @@
+"""Compare two benchmark result files, e.g. from the previous and the current release.
+
+    python -m benchmarks.compare old.json new.json
+"""
+import argparse
+import json
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--metric", default="p50_ms")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = {result["name"]: result for result in json.load(f)["results"]}
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+
+    print(f"{'name':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for result in current:
+        old = baseline.get(result["name"])
+        if old is None:
+            print(f"{result['name']:<24} {'-':>10} {result[args.metric]:>10.1f} {'new':>8}")
+            continue
+        change = f"{(result[args.metric] / old[args.metric] - 1) * 100:+.1f}%" if old[args.metric] else "-"
+        print(f"{result['name']:<24} {old[args.metric]:>10.1f} {result[args.metric]:>10.1f} {change:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Local stand-in for the Ghostfolio API used by the benchmarks.
+
+Serves accounts, holdings, performance, position and order fixtures with a
+configurable delay per request. Fixtures are either generated at a given size
+or replayed from a directory of recorded responses (``accounts.json``,
+``holdings.json``, ``performance.json``, ``positions.json`` keyed by symbol,
+and ``orders.json``), as saved by ``python -m benchmarks.fake_ghostfolio DIR``.
+"""
+import base64
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURE_NAMES = ("accounts", "holdings", "performance", "positions", "orders")
+
+
+def _jwt(lifetime: timedelta = timedelta(hours=6)) -> str:
+    def encode(data: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+    exp = int(time.time() + lifetime.total_seconds())
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode({'exp': exp})}.signature"
+
+
+def make_fixtures(holdings: int = 50, orders: int = 1000, chart_points: int = 2000, seed: int = 0) -> dict:
+    """Synthetic responses shaped like the ones recorded from a Ghostfolio instance."""
+    rng = random.Random(seed)
+    accounts = [
+        {"id": str(uuid.UUID(int=rng.getrandbits(128))), "name": name, "currency": currency}
+        for name, currency in (("Cathay", "TWD"), ("Firstrade", "USD"), ("Wallet", "USD"))
+    ]
+
+    holding_list, positions = [], {}
+    for i in range(holdings):
+        symbol = f"{1100 + i}.TW" if i % 2 else f"SYM{i}"
+        data_source = "COINGECKO" if i % 10 == 9 else "YAHOO"
+        currency = "TWD" if i % 2 else "USD"
+        quantity = rng.randrange(1, 5000)
+        price = round(rng.uniform(5, 1000), 2)
+        value = round(quantity * price, 2)
+        holding_list.append({
+            "name": f"Holding {i}", "symbol": symbol, "dataSource": data_source, "currency": currency,
+            "quantity": quantity, "marketPrice": price, "valueInBaseCurrency": value,
+            "allocationInPercentage": 1 / holdings,
+        })
+        investment = round(value * rng.uniform(0.5, 1.5), 2)
+        positions[symbol] = {
+            "SymbolProfile": {"name": f"Holding {i}", "symbol": symbol, "dataSource": data_source, "currency": currency},
+            "marketPrice": price, "quantity": quantity, "investment": investment, "value": value,
+            "netPerformance": round(value - investment, 2),
+            "orders": [], "historicalData": [{"date": f"2020-01-{day:02d}", "marketPrice": price} for day in range(1, 29)],
+        }
+
+    total = sum(holding["valueInBaseCurrency"] for holding in holding_list)
+    account_list = [
+        {**account, "value": round(total / len(accounts), 2), "valueInBaseCurrency": round(total / len(accounts), 2)}
+        for account in accounts
+    ]
+
+    start = date.today() - timedelta(days=chart_points)
+    value, chart = 1_000_000.0, []
+    for day in range(chart_points):
+        value *= 1 + rng.gauss(0.0003, 0.01)
+        chart.append({
+            "date": (start + timedelta(days=day)).isoformat(),
+            "netPerformanceInPercentage": value / 1_000_000 - 1,
+            "value": value,
+        })
+
+    order_list = []
+    for _ in range(orders):
+        holding = rng.choice(holding_list)
+        day = date(2010, 1, 1) + timedelta(days=rng.randrange(5000))
+        order_list.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "date": f"{day.isoformat()}T00:00:00.000Z",
+            "type": rng.choice(["BUY", "SELL", "DIVIDEND"]),
+            "quantity": rng.randrange(1, 100),
+            "unitPrice": round(rng.uniform(5, 1000), 2),
+            "fee": 0,
+            "accountId": rng.choice(accounts)["id"],
+            "Account": {"name": rng.choice(accounts)["name"]},
+            "SymbolProfile": {key: holding[key] for key in ("name", "symbol", "dataSource", "currency")},
+        })
+    order_list.sort(key=lambda order: (order["date"], order["id"]), reverse=True)
+
+    return {
+        "accounts": {"accounts": account_list, "totalValueInBaseCurrency": total},
+        "holdings": {"holdings": holding_list},
+        "performance": {"chart": chart, "performance": {"currentValueInBaseCurrency": value}},
+        "positions": positions,
+        "orders": order_list,
+    }
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The bot cancels requests that lost a race (e.g. probing data sources); not an error here.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def load_fixtures(directory: str) -> dict:
+    return {name: json.loads((Path(directory) / f"{name}.json").read_text()) for name in FIXTURE_NAMES}
+
+
+def record_fixtures(ghost, directory: str, orders: int = 1000):
+    """Save the responses of a real Ghostfolio instance for replay with load_fixtures."""
+    holdings = ghost.holdings()
+    fixtures = {
+        "accounts": ghost.accounts(),
+        "holdings": holdings,
+        "performance": ghost.performance(),
+        "positions": {
+            holding["symbol"]: ghost.position(holding.get("dataSource", "YAHOO"), holding["symbol"], full=True)
+            for holding in holdings["holdings"]
+        },
+        "orders": ghost.orders(num=orders)["activities"],
+    }
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    for name, data in fixtures.items():
+        (Path(directory) / f"{name}.json").write_text(json.dumps(data))
+
+
+class FakeGhostfolio:
+    """Threaded HTTP server answering the Ghostfolio endpoints the bot uses.
+
+    Every request sleeps ``latency`` seconds plus up to ``jitter`` seconds before
+    answering, to stand in for network and server time.
+    """
+
+    def __init__(self, fixtures: dict, latency: float = 0.0, jitter: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.imported = []
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                fake._delay()
+                url = urlsplit(self.path)
+                status, data = fake.get(url.path.strip("/").split("/"), parse_qs(url.query))
+                self._reply(status, data)
+
+            def do_POST(self):
+                fake._delay()
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, data = fake.post(urlsplit(self.path).path.strip("/").split("/"), body)
+                self._reply(status, data)
+
+        return Handler
+
+    def _delay(self):
+        with self._lock:
+            self.requests += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+
+    def get(self, path: list[str], query: dict) -> tuple[int, object]:
+        route = path[2:]
+        if route == ["account"]:
+            return 200, self.fixtures["accounts"]
+        if route == ["portfolio", "holdings"]:
+            return 200, self.fixtures["holdings"]
+        if route == ["portfolio", "performance"]:
+            return 200, self.fixtures["performance"]
+        if route[:2] == ["portfolio", "position"] and len(route) == 4:
+            position = self.fixtures["positions"].get(route[3])
+            if position is None or position["SymbolProfile"].get("dataSource", "YAHOO") != route[2]:
+                return 200, {}
+            return 200, position
+        if route in (["portfolio", "dividends"], ["portfolio", "investments"]):
+            kind = route[1]
+            orders = [order for order in self.fixtures["orders"]
+                      if (order["type"] == "DIVIDEND") == (kind == "dividends") and order["type"] != "SELL"]
+            year = query.get("range", ["max"])[0]
+            totals = {}
+            for order in orders:
+                if year.isdigit() and not order["date"].startswith(year):
+                    continue
+                month = f"{order['date'][:7]}-01"
+                totals[month] = totals.get(month, 0) + order["quantity"] * order["unitPrice"]
+            return 200, {kind: [{"date": month, "investment": amount} for month, amount in sorted(totals.items())]}
+        if route == ["order"]:
+            skip = int(query.get("skip", ["0"])[0])
+            take = int(query.get("take", ["10"])[0])
+            orders = self.fixtures["orders"]
+            return 200, {"activities": orders[skip:skip + take], "count": len(orders)}
+        return 404, {"message": "Not Found", "statusCode": 404}
+
+    def post(self, path: list[str], body: bytes) -> tuple[int, object]:
+        route = path[2:]
+        if route == ["auth", "anonymous"]:
+            return 201, {"authToken": _jwt()}
+        if route == ["import"]:
+            self.imported.extend(json.loads(body).get("activities", []))
+            return 201, {"activities": []}
+        return 404, {"message": "Not Found", "statusCode": 404}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.fake_ghostfolio DIR records fixtures from $HOST with $GHOSTFOLIO_TOKEN.
+    import os
+
+    from ghostfolio import Ghostfolio
+
+    client = Ghostfolio(token=os.environ["GHOSTFOLIO_TOKEN"], host=os.getenv("HOST", "https://ghostfol.io/"))
+    record_fixtures(client, sys.argv[1])
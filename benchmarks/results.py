@@ -0,0 +1,48 @@
+"""Machine-readable benchmark results, comparable across releases."""
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+def summarize(name: str, timings: list[float], **extra) -> dict:
+    seconds = np.asarray(timings)
+    return {
+        "name": name,
+        "runs": len(timings),
+        "min_ms": float(seconds.min() * 1000),
+        "mean_ms": float(seconds.mean() * 1000),
+        "p50_ms": float(np.percentile(seconds, 50) * 1000),
+        "p95_ms": float(np.percentile(seconds, 95) * 1000),
+        "max_ms": float(seconds.max() * 1000),
+        **extra,
+    }
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write(suite: str, params: dict, results: list[dict], output: str | None):
+    """Write results as JSON to output, or to stdout when output is None or "-"."""
+    document = {
+        "suite": suite,
+        "commit": _commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(document, indent=2)
+    if output in (None, "-"):
+        print(text)
+    else:
+        with open(output, "w") as f:
+            f.write(text + "\n")
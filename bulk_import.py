@@ -0,0 +1,102 @@
+from collections import Counter
+from dataclasses import dataclass
+
+import httpx
+
+from models import activity_key
+
+DEFAULT_BATCH_SIZE = 50
+
+
+@dataclass
+class ChunkResult:
+    """Outcome of one import request covering activities[start:start + size]."""
+    start: int
+    size: int
+    ok: bool
+    error: str | None = None
+
+
+def flatten(payloads: list[dict]) -> list[dict]:
+    """Merge DataImporter's one-activity payloads into a single activity list."""
+    return [activity for payload in payloads for activity in payload["activities"]]
+
+
+def drop_existing(payloads: list[dict], existing: Counter) -> tuple[list[dict], int]:
+    """Remove payload activities already in existing, a Counter of activity_keys; returns (kept, skipped).
+
+    Each key is skipped only as often as it exists, so a second identical fill
+    on the same day is still imported when only the first one is.
+    """
+    existing = Counter(existing)
+    kept = []
+    for payload in payloads:
+        activities = []
+        for activity in payload["activities"]:
+            key = activity_key(activity)
+            if existing[key] > 0:
+                existing[key] -= 1
+            else:
+                activities.append(activity)
+        if activities:
+            kept.append({**payload, "activities": activities})
+    return kept, len(flatten(payloads)) - len(flatten(kept))
+
+
+def preview(activities: list[dict], samples: int = 5) -> str:
+    """Short human readable summary of the activities about to be imported."""
+    if not activities:
+        return "No activities found"
+
+    types = Counter(activity["type"] for activity in activities)
+    symbols = {activity["symbol"] for activity in activities}
+    dates = sorted(activity["date"][:10] for activity in activities)
+
+    lines = [f"{len(activities)} activities, {len(symbols)} symbols, {dates[0]} to {dates[-1]}"]
+    lines += [f"\t\t {activity_type}: {count}" for activity_type, count in types.most_common()]
+    lines.append("")
+    for activity in activities[:samples]:
+        lines.append(f"{activity['date'][:10]} {activity['type']} {activity.get('quantity')} {activity['symbol']} at {activity.get('unitPrice')}")
+    if len(activities) > samples:
+        lines.append(f"... and {len(activities) - samples} more")
+    return "\n".join(lines)
+
+
+async def import_in_chunks(ghost, activities: list[dict], batch_size: int = DEFAULT_BATCH_SIZE) -> list[ChunkResult]:
+    """Import activities in chunks of batch_size.
+
+    A chunk rejected by Ghostfolio (4xx) is split in half and retried until the
+    offending activities are isolated, so one bad row does not fail a whole chunk.
+    """
+    results = []
+    for start in range(0, len(activities), batch_size):
+        await _import_chunk(ghost, activities, start, min(start + batch_size, len(activities)), results)
+    return results
+
+
+async def _import_chunk(ghost, activities, start, end, results):
+    try:
+        await ghost.import_transactions({"activities": activities[start:end]})
+    except httpx.HTTPStatusError as e:
+        if e.response.is_client_error and end - start > 1:
+            middle = (start + end) // 2
+            await _import_chunk(ghost, activities, start, middle, results)
+            await _import_chunk(ghost, activities, middle, end, results)
+            return
+        results.append(ChunkResult(start, end - start, False, e.response.text))
+        return
+    except httpx.HTTPError as e:
+        results.append(ChunkResult(start, end - start, False, str(e)))
+        return
+
+    results.append(ChunkResult(start, end - start, True))
+
+
+def report(results: list[ChunkResult]) -> str:
+    imported = sum(result.size for result in results if result.ok)
+    failed = sum(result.size for result in results if not result.ok)
+    lines = [f"Imported {imported} activities, {failed} failed"]
+    for result in results:
+        status = "OK" if result.ok else f"Failed: {result.error}"
+        lines.append(f"\t\t #{result.start + 1}-{result.start + result.size}: {status}")
+    return "\n".join(lines)
@@ -0,0 +1,57 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """LRU cache whose entries expire after a per-entry time to live.
+
+    Values are stored as-is, so callers must treat cached objects as read-only.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self, prefix: tuple = ()):
+        """Drop every entry, or only those whose tuple key starts with prefix."""
+        if not prefix:
+            self._data.clear()
+            return
+        for key in [key for key in self._data if key[:len(prefix)] == prefix]:
+            del self._data[key]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def __contains__(self, key) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+from matplotlib.figure import Figure
+
+from cache import TTLCache
+from metrics import METRICS
+
+# Rendered charts are keyed by a fingerprint of their data, so they never go stale.
+CHART_CACHE_TTL = 24 * 60 * 60
+CHART_SIZE = (6.4, 4.8)
+CHART_DPI = 100
+# Long series are downsampled to about one point per horizontal pixel before plotting.
+MAX_CHART_POINTS = int(CHART_SIZE[0] * CHART_DPI)
+
+
+def extract_series(chart: list[dict]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Turn Ghostfolio chart points into (dates, performance, value) arrays."""
+    dates = np.array([data["date"][:10] for data in chart], dtype="datetime64[D]")
+    performance = np.fromiter((data["netPerformanceInPercentage"] for data in chart), dtype=float, count=len(chart))
+    value = np.fromiter((data["value"] for data in chart), dtype=float, count=len(chart))
+    if len(value) > 1 and value[0] == 0:
+        value[0] = value[1]
+    return dates, performance, value
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = x.astype(float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    indices = np.empty(threshold, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle vertex.
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        prev = indices[i]
+        areas = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        indices[i + 1] = start + int(np.argmax(areas))
+    return indices
+
+
+def render_performance(dates: np.ndarray, performance: np.ndarray, value: np.ndarray, title: str, demo_mode: bool) -> bytes:
+    """Render a performance chart as PNG bytes.
+
+    Uses the object-oriented Figure API rather than pyplot, so no global state
+    is shared and it is safe to run in a worker process.
+    """
+    # draw a line chart, performance and value is y-axis, date is x-axis
+    fig = Figure(figsize=CHART_SIZE, dpi=CHART_DPI)
+    ax = fig.subplots()
+    ax.plot(dates, performance, color="tab:blue", label="Performance")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Performance")
+    ax.legend(loc="upper left")
+    locator = AutoDateLocator()
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+    if not demo_mode:
+        ax2 = ax.twinx()
+        ax2.plot(dates, value, color="tab:red", label="Value in TWD")
+        ax2.get_yaxis().get_major_formatter().set_scientific(False)
+        ax2.set_ylabel("Value in TWD")
+        ax2.legend(loc="upper right")
+
+    ax.set_title(title)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def render_bars(labels: list[str], amounts: np.ndarray, title: str, demo_mode: bool) -> bytes:
+    """Render per-period totals as a bar chart, PNG bytes."""
+    fig = Figure(figsize=CHART_SIZE, dpi=CHART_DPI)
+    ax = fig.subplots()
+    ax.bar(np.arange(len(labels)), amounts, color="tab:blue")
+    # Label at most about 12 bars, so long monthly series stay readable.
+    step = max(len(labels) // 12, 1)
+    ax.set_xticks(np.arange(0, len(labels), step), labels[::step], rotation=45, ha="right")
+    if demo_mode:
+        ax.set_yticklabels([])
+    else:
+        ax.get_yaxis().get_major_formatter().set_scientific(False)
+        ax.set_ylabel("TWD")
+    ax.set_title(title)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def fingerprint(data) -> str:
+    return hashlib.blake2b(json.dumps(data, separators=(",", ":")).encode(), digest_size=16).hexdigest()
+
+
+class ChartRenderer:
+    """Renders charts in a process pool and caches the resulting PNG bytes."""
+
+    def __init__(self, max_workers: int = 2, cache_size: int = 32):
+        self._executor = ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self.cache = TTLCache(cache_size)
+
+    async def _render(self, key, func, *args) -> bytes:
+        png = self.cache.get(key)
+        if png is None:
+            with METRICS.timer(f"chart:render {key[0]}"):
+                png = await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+            self.cache.set(key, png, CHART_CACHE_TTL)
+        return png
+
+    async def performance(self, chart: list[dict], date_range: str, demo_mode: bool) -> bytes:
+        key = ("performance", date_range, demo_mode, fingerprint(chart))
+        if key in self.cache:
+            return self.cache.get(key)
+
+        dates, performance, value = extract_series(chart)
+        x = dates.astype("int64")
+        performance_idx = lttb(x, performance, MAX_CHART_POINTS)
+        value_idx = lttb(x, value, MAX_CHART_POINTS)
+        # Both lines share the x axis, so keep the union of the points either series needs.
+        keep = np.union1d(performance_idx, value_idx) if not demo_mode else performance_idx
+        return await self._render(key, render_performance, dates[keep], performance[keep], value[keep],
+                                  f"Performance of {date_range}", demo_mode)
+
+    async def bars(self, labels: list[str], amounts: np.ndarray, title: str, demo_mode: bool) -> bytes:
+        key = ("bars", title, demo_mode, fingerprint([labels, amounts.tolist()]))
+        return await self._render(key, render_bars, labels, amounts, title, demo_mode)
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
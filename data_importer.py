@@ -1,147 +1,303 @@
+import asyncio
+import csv
+import io
+import zipfile
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from bs4 import BeautifulSoup
-import requests
+
+from models import activity_key
+from stock_map import StockMap
 
 TW_ACCOUNT_ID = "940ff92e-7e3c-42a4-bbad-9a6fa9eab519"
 TW2_ACCOUNT_ID = "b0a06267-2091-4ada-a38d-3243cf9ddc9b"
 US_ACCOUNT_ID = "8dab33c4-8ee3-42c3-a088-943367115688"
 CRYPTO_ACCOUNT_ID = "ef2494d7-0734-47b2-901e-5625debb912e"
+TW_ACCOUNT_CODES = ["2330.TW", "00878.TW", "006208.TW"]
+
+IMPORT_COMMENT = "Imported from importer script"
+DEFAULT_CHUNK_SIZE = 10_000
+# Per /import: CSV files (zip members included) and their total uncompressed size.
+MAX_UPLOAD_FILES = 50
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+CATHAY_ACTIONS = {
+    "現買": "BUY",
+    "現賣": "SELL",
+}
+FT_ACTIONS = {
+    "BUY": "BUY",
+    "SELL": "SELL",
+    "Dividend": "DIVIDEND",
+    "Interest": "INTEREST",
+    "Other": "SKIP"
+}
+
+
+def _map_action(values, action_map):
+    actions = values.map(action_map)
+    if actions.isna().any():
+        raise ValueError(f"Unknown value {values[actions.isna()].iloc[0]}")
+    return actions
+
+
+def _to_number(values):
+    if not pd.api.types.is_numeric_dtype(values):
+        values = pd.to_numeric(values.astype(str).str.replace(",", "", regex=False))
+    return values.astype("int64")
+
+
+def _to_isoformat(values, date_format):
+    return pd.to_datetime(values, format=date_format).dt.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _to_payloads(records):
+    # to_dict converts numpy scalars to builtin types, so the payloads stay JSON serializable.
+    return [{"activities": [record]} for record in records.to_dict("records")]
+
+
+@dataclass(frozen=True)
+class Parser:
+    """A broker export format: the header columns that identify it and how to turn rows into activities."""
+    name: str
+    columns: frozenset
+    skiprows: int
+    frame_to_records: Callable[[pd.DataFrame, dict], pd.DataFrame]
+    needs_stock_map: bool = False
+
+
+PARSERS: dict[str, Parser] = {}
+
+
+def register_parser(name, columns, skiprows=0, needs_stock_map=False):
+    """Register frame_to_records(df, stock_map) -> DataFrame of activities for a broker's CSV export."""
+    def decorator(func):
+        PARSERS[name] = Parser(name, frozenset(columns), skiprows, func, needs_stock_map)
+        return func
+    return decorator
+
+
+def detect_broker(head):
+    """Name of the registered parser whose header columns appear in the first lines of a CSV."""
+    lines = head.splitlines()
+    for parser in PARSERS.values():
+        if len(lines) > parser.skiprows:
+            header = {column.strip() for column in next(csv.reader([lines[parser.skiprows]]))}
+            if parser.columns <= header:
+                return parser.name
+    raise ValueError("Unknown CSV format")
+
+
+@register_parser("cathay", ["日期", "股名", "買賣別", "成交股數", "成交價", "手續費", "交易稅"], skiprows=1, needs_stock_map=True)
+def cathay_records(df, stock_map):
+    if not stock_map:
+        stock_map.update(StockMap().refresh().as_dict())
+
+    codes = df["股名"].map(stock_map)
+    if codes.isna().any():
+        raise ValueError(f"Unknown stock name {df.loc[codes.isna(), '股名'].iloc[0]}")
+
+    return pd.DataFrame({
+        "accountId": np.where(codes.isin(TW_ACCOUNT_CODES), TW_ACCOUNT_ID, TW2_ACCOUNT_ID),
+        "currency": "TWD",
+        "dataSource": "YAHOO",
+        "date": _to_isoformat(df["日期"], "%Y/%m/%d"),
+        "fee": _to_number(df["手續費"]) + _to_number(df["交易稅"]),
+        "quantity": _to_number(df["成交股數"]),
+        "symbol": codes,
+        "type": _map_action(df["買賣別"], CATHAY_ACTIONS),
+        "unitPrice": df["成交價"],
+        "comment": IMPORT_COMMENT,
+    })
+
+
+@register_parser("ft", ["Symbol", "Quantity", "Price", "Action", "TradeDate", "Amount", "Fee"])
+def ft_records(df, stock_map):
+    actions = _map_action(df["Action"], FT_ACTIONS)
+    keep = actions != "SKIP"
+    df, actions = df[keep], actions[keep]
+
+    is_trade = actions.isin(["BUY", "SELL"])
+    is_interest = actions == "INTEREST"
+    return pd.DataFrame({
+        "accountId": US_ACCOUNT_ID,
+        "currency": "USD",
+        "dataSource": np.where(is_interest, "MANUAL", "YAHOO"),
+        "date": _to_isoformat(df["TradeDate"], "%Y-%m-%d"),
+        "symbol": df["Symbol"].str.split(" ").str[0].where(~is_interest, "Interest"),
+        "fee": df["Fee"],
+        "type": actions,
+        "comment": IMPORT_COMMENT,
+        "quantity": df["Quantity"].abs().where(is_trade, 1),
+        "unitPrice": df["Price"].where(is_trade, df["Amount"]),
+    })
+
 
 class DataImporter():
-    def __init__(self, broker, file):
-        if broker not in ["cathay", "ft"]:
+    def __init__(self, broker, file, stock_map=None):
+        """broker is a registered parser name, or None to detect it from the header of file."""
+        if broker is None:
+            broker = detect_broker(file.read(4096))
+            file.seek(0)
+        if broker not in PARSERS:
             raise Exception("Invalid broker")
         self._broker = broker
-        self._stock_map = {}
-        if broker == "cathay":
-            self._activities = self._parse_cathay_csv(file)
-        elif broker == "ft":
-            self._activities = self._parse_ft_csv(file)
-
-    def _update_stock_map(self, url):
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, "html.parser")
-        table = soup.find("table", class_="h4")
-
-        for row in table.find_all('tr')[1:]:  # 跳過表頭
-            cols = row.find_all('td')
-            if len(cols) >= 4:
-                code_name = cols[0].text.strip()
-                code, name = code_name.split("\u3000")
-                stock_type = cols[3].text.strip()
-
-                if code and code[0].isdigit():  # 確保是股票代碼
-                    if stock_type == "上市":
-                        self._stock_map[name] = code + ".TW"
-                    elif stock_type == "上櫃":
-                        self._stock_map[name] = code + ".TWO"
-
-    def _parse_cathay_csv(self, file):
-        def get_action(value):
-            if value == "現買":
-                return "BUY"
-            elif value == "現賣":
-                return "SELL"
-            raise ValueError(f"Unknown value {value}")
-
-        def get_code_by_name(name):
-            if not self._stock_map:
-                self._update_stock_map("https://isin.twse.com.tw/isin/C_public.jsp?strMode=2")
-                self._update_stock_map("https://isin.twse.com.tw/isin/C_public.jsp?strMode=4")
-
-            if name in self._stock_map:
-                return self._stock_map[name]
-            else:
-                raise ValueError(f"Unknown stock name {name}")
-
-        def get_account_id_by_code(code):
-            if code in ["2330.TW", "00878.TW", "006208.TW"]:
-                return TW_ACCOUNT_ID
-            else:
-                return TW2_ACCOUNT_ID
-
-        def to_number(value):
-            return int(str(value).replace(",", ""))
-
-        df = pd.read_csv(file, skiprows=1)
-        res = []
-        for _, row in df.iterrows():
-            code = get_code_by_name(row["股名"])
-            account_id = get_account_id_by_code(code)
-            data = {
-                "activities": [
-                    {
-                        "accountId": account_id,
-                        "currency": "TWD",
-                        "dataSource": "YAHOO",
-                        "date": datetime.strptime(row["日期"], "%Y/%m/%d").isoformat(),
-                        "fee": to_number(row["手續費"]) + to_number(row["交易稅"]),
-                        "quantity": to_number(row["成交股數"]),
-                        "symbol": code,
-                        "type": get_action(row["買賣別"]),
-                        "unitPrice": row["成交價"],
-                        "comment": "Imported from importer script"
-                    }
-                ]
-            }
-            res.append(data)
-        return res
-
-    def _parse_ft_csv(self, file):
-        def get_action(value):
-            action_map = {
-                "BUY": "BUY",
-                "SELL": "SELL",
-                "Dividend": "DIVIDEND",
-                "Interest": "INTEREST",
-                "Other": "SKIP"
-            }
-            if value not in action_map:
-                raise ValueError(f"Unknown value {value}")
-            return action_map[value]
-
-        df = pd.read_csv(file)
-        res = []
-        for _, row in df.iterrows():
-            action = get_action(row["Action"])
-            data = {
-                "activities": [
-                    {
-                        "accountId": US_ACCOUNT_ID,
-                        "currency": "USD",
-                        "dataSource": "YAHOO",
-                        "date": datetime.strptime(row["TradeDate"], "%Y-%m-%d").isoformat(),
-                        "symbol": row["Symbol"].split(" ")[0],
-                        "fee": row["Fee"],
-                        "type": action,
-                        "comment": "Imported from importer script"
-                    }
-                ]
-            }
-            extra_data = {}
-            if action == "DIVIDEND":
-                extra_data["quantity"] = 1
-                extra_data["unitPrice"] = row["Amount"]
-            elif action == "INTEREST":
-                extra_data["symbol"] = "Interest"
-                extra_data["dataSource"] = "MANUAL"
-                extra_data["quantity"] = 1
-                extra_data["unitPrice"] = row["Amount"]
-            elif action == "BUY" or action == "SELL":
-                extra_data["quantity"] = abs(row["Quantity"])
-                extra_data["unitPrice"] = row["Price"]
-            elif action == "SKIP":
-                continue
-
-            data["activities"][0].update(extra_data)
-            res.append(data)
-        return res
+        self._parser = PARSERS[broker]
+        self._stock_map = dict(stock_map or {})
+        self._file = file
+        self._activities = None
+
+    @property
+    def broker(self):
+        return self._broker
+
+    def batches(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Parse the CSV chunk_size rows at a time, yielding a list of import payloads per chunk."""
+        with pd.read_csv(self._file, skiprows=self._parser.skiprows, chunksize=chunk_size) as reader:
+            for df in reader:
+                yield _to_payloads(self._parser.frame_to_records(df, self._stock_map))
 
     def activities(self):
+        if self._activities is None:
+            self._activities = [activity for batch in self.batches() for activity in batch]
         return self._activities
 
 
+def split_csv(data, skiprows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Split CSV bytes into pieces of at most chunk_size rows, each starting with the header lines.
+
+    Pieces are only cut outside quoted fields, so a value spanning lines stays whole.
+    """
+    lines = data.splitlines(keepends=True)
+    head = b"".join(lines[:skiprows + 1])
+    pieces, rows, in_quotes = [], [], False
+    for line in lines[skiprows + 1:]:
+        rows.append(line)
+        in_quotes ^= line.count(b'"') % 2 == 1
+        if not in_quotes and len(rows) >= chunk_size:
+            pieces.append(head + b"".join(rows))
+            rows = []
+    if rows or not pieces:
+        pieces.append(head + b"".join(rows))
+    return pieces
+
+
+def _parse_csv(name, broker, data, stock_map):
+    """Process pool worker: activities of one CSV piece given as bytes."""
+    try:
+        return [payload["activities"][0]
+                for payload in DataImporter(broker, io.StringIO(data.decode("utf-8-sig")), stock_map).activities()]
+    except Exception as e:
+        raise ValueError(f"{name}: {e}") from None
+
+
+def expand_uploads(uploads, max_files=MAX_UPLOAD_FILES, max_bytes=MAX_UPLOAD_BYTES):
+    """(name, bytes) of every CSV in uploads, looking inside ZIP archives.
+
+    Zip members are checked against the limits by their declared size before
+    they are decompressed, so a small archive cannot expand without bound.
+    """
+    files, size = [], 0
+
+    def add(name, file_size):
+        nonlocal size
+        size += file_size
+        if len(files) >= max_files:
+            raise ValueError(f"Too many files, at most {max_files} per import")
+        if size > max_bytes:
+            raise ValueError(f"{name}: files larger than {max_bytes // 2 ** 20} MB in total")
+
+    for name, data in uploads:
+        if zipfile.is_zipfile(io.BytesIO(data)):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(".csv") or info.filename.startswith("__MACOSX/"):
+                        continue
+                    add(f"{name}/{info.filename}", info.file_size)
+                    # Reads stop at the declared file_size.
+                    files.append((f"{name}/{info.filename}", archive.read(info)))
+        else:
+            add(name, len(data))
+            files.append((name, data))
+    return files
+
+
+def merge_activities(parsed):
+    """Merge per-file activity lists into one list sorted by date.
+
+    Overlapping exports repeat the same activities, so each activity_key is kept
+    as often as it occurs in the file that has it most, not once per file.
+    """
+    counts = Counter()
+    for activities in parsed:
+        counts |= Counter(activity_key(activity) for activity in activities)
+
+    merged = []
+    for activity in sorted((activity for activities in parsed for activity in activities),
+                           key=lambda activity: (activity["date"], activity["symbol"], activity["type"])):
+        key = activity_key(activity)
+        if counts[key]:
+            counts[key] -= 1
+            merged.append(activity)
+    return merged
+
+
+async def parse_uploads(uploads, executor, stock_map=None, chunk_size=DEFAULT_CHUNK_SIZE, on_parsed=None):
+    """Parse uploaded CSV and ZIP files in executor, returning merged import payloads and the brokers found.
+
+    Every file is split into pieces of chunk_size rows and each piece is parsed
+    by its own worker, so a worker never holds more than one piece and large
+    files use the whole pool. on_parsed(name, activities, pending), if given, is
+    awaited as each piece finishes, so callers can show the first results while
+    the rest is still parsing. Merging needs every file, so their activities are
+    kept until then.
+    """
+    files = expand_uploads(uploads)
+    if not files:
+        raise ValueError("No CSV files found")
+    brokers = []
+    for name, data in files:
+        try:
+            brokers.append(detect_broker(data[:4096].decode("utf-8-sig", errors="ignore")))
+        except ValueError as e:
+            raise ValueError(f"{name}: {e}") from None
+
+    # Load the stock map once here instead of once per worker.
+    stock_map = dict(stock_map or {})
+    if not stock_map and any(PARSERS[broker].needs_stock_map for broker in brokers):
+        stock_map = await asyncio.to_thread(lambda: StockMap().refresh().as_dict())
+
+    loop = asyncio.get_running_loop()
+    pieces = [
+        (index, piece)
+        for index, ((name, data), broker) in enumerate(zip(files, brokers))
+        for piece in split_csv(data, PARSERS[broker].skiprows, chunk_size)
+    ]
+
+    async def parse(position, index, piece):
+        name = files[index][0]
+        return position, index, await loop.run_in_executor(executor, _parse_csv, name, brokers[index], piece, stock_map)
+
+    tasks = [asyncio.ensure_future(parse(position, index, piece)) for position, (index, piece) in enumerate(pieces)]
+    parsed = [None] * len(tasks)
+    try:
+        for finished, done in enumerate(asyncio.as_completed(tasks), start=1):
+            position, index, activities = await done
+            parsed[position] = (index, activities)
+            if on_parsed is not None:
+                await on_parsed(files[index][0], activities, len(tasks) - finished)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    per_file = [[] for _ in files]
+    for index, activities in parsed:
+        per_file[index].extend(activities)
+    return [{"activities": [activity]} for activity in merge_activities(per_file)], Counter(brokers)
+
+
 if __name__ == "__main__":
     importer = DataImporter("cathay", "cathay.csv")
     print(importer.activities())
@@ -1,62 +1,347 @@
+import asyncio
+import base64
 import logging
+import threading
+import time
+from collections import Counter
 from datetime import datetime, timedelta
 
+import httpx
+import orjson
 import requests
 from requests.exceptions import HTTPError
+from urllib3.exceptions import NewConnectionError
 import json
 
+from cache import TTLCache
+from models import activity_key, drop_keys
+from rate_limit import RetryPolicy, TokenBucket
+from tasks import SingleFlight
+
+# Per-endpoint settings are matched on the longest endpoint prefix, e.g. the
+# "portfolio/position" entry also applies to "portfolio/position/YAHOO/AAPL".
+DEFAULT_TIMEOUT = 15.0
+DEFAULT_TIMEOUTS = {
+    "portfolio/performance": 60.0,
+    "import": 120.0,
+}
+DEFAULT_CONCURRENCY = {
+    "portfolio/performance": 2,
+    "import": 1,
+    "admin/market-data": 4,
+}
+# Seconds a GET response is served from cache; endpoints not listed are never cached.
+DEFAULT_CACHE_TTLS = {
+    "account": 60,
+    "portfolio/details": 60,
+    "portfolio/holdings": 60,
+    "portfolio/position": 60,
+    "portfolio/performance": 300,
+    "portfolio/investments": 600,
+    "portfolio/dividends": 600,
+}
+# Refresh the JWT this long before its exp claim, so requests never race the expiry.
+# Short-lived tokens use a quarter of their lifetime instead.
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+# Background renewal never fires sooner than this after a fetch.
+MIN_TOKEN_REFRESH_DELAY = timedelta(seconds=10)
+# Client-side throttle: sustained requests per second and burst size.
+DEFAULT_RATE_LIMIT = (10.0, 20.0)
+# The server refused these without processing the request, so resending is always safe.
+SAFE_RETRY_STATUSES = {429, 503}
+# The request may or may not have been applied; only GETs are resent blindly.
+AMBIGUOUS_RETRY_STATUSES = {500, 502, 504}
+IDEMPOTENCY_PAGE_SIZE = 250
+_MISSING = object()
+_SLIM_POSITION = drop_keys("orders", "historicalData")
+
+
+def _endpoint_setting(table: dict, endpoint: str, default=None):
+    """Return the value for the longest prefix of endpoint found in table."""
+    matches = [prefix for prefix in table if endpoint.startswith(prefix)]
+    if not matches:
+        return default
+    return table[max(matches, key=len)]
+
+
+def _jwt_expiry(jwt_token: str) -> datetime:
+    """Read the expiry from the token's exp claim, assuming 30 days if it has none."""
+    try:
+        payload = jwt_token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return datetime.fromtimestamp(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        logging.warning("JWT has no readable exp claim, assuming 30 days")
+        return datetime.now() + timedelta(days=30)
+
+
+class _ImportCheck:
+    """Matches an import payload against pages of existing orders, newest first.
+
+    Keys are counted, so a payload repeating an activity is only applied once
+    the order exists as many times as the payload has it.
+    """
+
+    def __init__(self, data: dict):
+        self.wanted = Counter(activity_key(activity) for activity in data["activities"])
+        self.oldest = min((activity["date"][:10] for activity in data["activities"]), default="")
+        self.matched: list[dict] = []
+        self.skip = 0
+        self.done = not self.wanted
+
+    def add_page(self, activities: list[dict]):
+        for activity in activities:
+            key = activity_key(activity)
+            if self.wanted[key] > 0:
+                self.wanted[key] -= 1
+                self.matched.append(activity)
+        self.skip += len(activities)
+        # Orders come newest first, so stop once past the oldest imported date.
+        self.done = (self.applied or len(activities) < IDEMPOTENCY_PAGE_SIZE
+                     or activities[-1]["date"][:10] < self.oldest)
+
+    @property
+    def applied(self) -> bool:
+        return not +self.wanted
+
 
 class Ghostfolio:
     """Ghostfolio API client."""
 
-    def __init__(self, token: str, host: str = "https://ghostfol.io/"):
+    # Transport errors raised before the request reached the server / at any point.
+    _connect_errors = (requests.exceptions.ConnectTimeout,)
+    _transport_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    _http_errors = (HTTPError,)
+
+    def __init__(self, token: str, host: str = "https://ghostfol.io/", timeouts: dict | None = None,
+                 cache_ttls: dict | None = None, cache: TTLCache | None = None,
+                 rate_limiter: TokenBucket | None = None, retry_policy: RetryPolicy | None = None):
         self.host = host
         self.token = token
         self._jwt_token: str | None = None
         self._jwt_token_expiry: datetime | None = None
+        self._jwt_refresh_margin = TOKEN_REFRESH_MARGIN
+        self._jwt_lock = threading.Lock()
+        self._timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self._cache_ttls = {**DEFAULT_CACHE_TTLS, **(cache_ttls or {})}
+        self.cache = cache if cache is not None else TTLCache()
+        self.rate_limiter = rate_limiter or TokenBucket(*DEFAULT_RATE_LIMIT)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = {"requests": 0, "retries": 0, "retry_wait": 0.0, "throttle_wait": 0.0}
+        # Optional callback(name, seconds, failed) invoked after every HTTP request.
+        self.on_request = None
+        # Bumped by every write, so a GET that started before it does not cache its result.
+        self._epoch = 0
+        self._session = self._new_session()
 
-    def _refresh_jwt_token(self):
-        if self._jwt_token is not None and self._jwt_token_expiry < datetime.now():
-            return
+    def _new_session(self):
+        return requests.Session()
 
-        self._jwt_token = self._process_response(
-            requests.post(
-                f"{self.host}/api/v1/auth/anonymous/", {"accessToken": self.token}
-            )
-        )["authToken"]
-        self._jwt_token_expiry = datetime.now() + timedelta(days=30)
+    def _timeout(self, endpoint: str) -> float:
+        return _endpoint_setting(self._timeouts, endpoint, DEFAULT_TIMEOUT)
 
-    def _get(self, endpoint: str, params=None, api_version: str = "v1"):
-        self._refresh_jwt_token()
+    def _cache_key(self, endpoint: str, params, api_version: str, project=None):
+        ttl = _endpoint_setting(self._cache_ttls, endpoint)
+        if not ttl:
+            return None, None
+        # Keys start with the client's hash, so clients for different portfolios can share one cache.
+        return (hash(self), api_version, endpoint, tuple(sorted((params or {}).items())), project), ttl
 
-        return self._process_response(
-            requests.get(
-                f"{self.host}/api/{api_version}/{endpoint}/",
-                headers={"Authorization": f"Bearer {self._jwt_token}"},
-                params=params,
-            )
+    def _token_is_fresh(self, rejected: str | None = None) -> bool:
+        return (
+            self._jwt_token is not None
+            and self._jwt_token != rejected
+            and datetime.now() < self._jwt_token_expiry - self._jwt_refresh_margin
         )
 
-    def _post(self, endpoint: str, data=None, api_version: str = "v1"):
-        self._refresh_jwt_token()
+    def _set_jwt_token(self, jwt_token: str):
+        self._jwt_token = jwt_token
+        self._jwt_token_expiry = _jwt_expiry(jwt_token)
+        lifetime = max(self._jwt_token_expiry - datetime.now(), timedelta(0))
+        self._jwt_refresh_margin = min(TOKEN_REFRESH_MARGIN, lifetime / 4)
+
+    def _refresh_jwt_token(self, rejected: str | None = None):
+        """Fetch a new JWT unless the cached one is fresh.
+
+        ``rejected`` is a token the server answered 401 for; it is only replaced
+        once, however many requests saw the 401.
+        """
+        with self._jwt_lock:
+            if self._token_is_fresh(rejected):
+                return
+
+            self._set_jwt_token(self._process_response(
+                self._session.post(
+                    f"{self.host}/api/v1/auth/anonymous/", {"accessToken": self.token},
+                    timeout=self._timeout("auth/anonymous"),
+                )
+            )["authToken"])
 
-        return self._process_response(
-            requests.post(
-                f"{self.host}/api/{api_version}/{endpoint}/",
-                headers={"Authorization": f"Bearer {self._jwt_token}"},
-                json=data,
-            )
+    def _send(self, method: str, endpoint: str, api_version: str, **kwargs):
+        return self._session.request(
+            method,
+            f"{self.host}/api/{api_version}/{endpoint}/",
+            headers={"Authorization": f"Bearer {self._jwt_token}"},
+            timeout=self._timeout(endpoint),
+            **kwargs,
         )
 
-    @staticmethod
-    def _process_response(resp):
+    def _report(self, method: str, endpoint: str, seconds: float, resp, error):
+        if self.on_request is not None:
+            # Keep only the route, e.g. "portfolio/position/YAHOO/AAPL" -> "portfolio/position".
+            route = "/".join(endpoint.split("/")[:2])
+            self.on_request(f"{method} {route}", seconds, error is not None or resp.status_code >= 400)
+
+    def _is_connect_error(self, error: Exception) -> bool:
+        if isinstance(error, self._connect_errors):
+            return True
+        # requests wraps refused connections in a generic ConnectionError.
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, NewConnectionError)
+
+    def _retry_action(self, method: str, endpoint: str, resp, error) -> str:
+        """How to handle a response or transport error.
+
+        Returns "done", "retry" (resending is safe), "check" (an import may have
+        been applied, verify before resending) or "fail".
+        """
+        if error is None:
+            if resp.status_code in SAFE_RETRY_STATUSES:
+                return "retry"
+            if resp.status_code not in AMBIGUOUS_RETRY_STATUSES:
+                return "done"
+        elif self._is_connect_error(error):
+            return "retry"
+
+        if method == "GET":
+            return "retry"
+        return "check" if endpoint == "import" else "fail"
+
+    def _retry_delay(self, attempt: int, resp) -> float | None:
+        delay = self.retry_policy.delay(attempt, resp.headers.get("Retry-After") if resp is not None else None)
+        if delay is not None:
+            self.metrics["retries"] += 1
+            self.metrics["retry_wait"] += delay
+        return delay
+
+    def _import_applied(self, data: dict) -> dict | None:
+        """The existing orders matching every activity of an import payload, or None if some are missing."""
+        check = _ImportCheck(data)
+        while not check.done:
+            check.add_page(self.orders(num=IDEMPOTENCY_PAGE_SIZE, skip=check.skip).get("activities", []))
+        return {"activities": check.matched} if check.applied else None
+
+    def _request_steps(self, method: str, endpoint: str, api_version: str, kwargs: dict):
+        """Retry, re-authentication and import idempotency decisions for one request, without I/O.
+
+        A generator shared by the sync and async clients: it yields (step, arg)
+        and the client's _request performs the step and sends back its result:
+        "throttle" (seconds waited), "send" ((response, transport error)),
+        "refresh" (the rejected JWT), "check" (the import payload; the matching
+        orders, None or the exception raised) and "sleep" (seconds). It returns
+        the decoded response or raises.
+        """
+        refreshed = False
+        attempt = 0
+        while True:
+            self.metrics["throttle_wait"] += yield "throttle", None
+            self.metrics["requests"] += 1
+            jwt_token = self._jwt_token
+            start = time.perf_counter()
+            resp, error = yield "send", None
+            self._report(method, endpoint, time.perf_counter() - start, resp, error)
+
+            if resp is not None and resp.status_code == 401 and not refreshed:
+                refreshed = True
+                yield "refresh", jwt_token
+                continue
+
+            action = self._retry_action(method, endpoint, resp, error)
+            if action == "check":
+                applied = yield "check", kwargs["json"]
+                if isinstance(applied, Exception):
+                    logging.warning("Could not check whether the import was applied: %s", applied)
+                    action, applied = "fail", None
+                if applied is not None:
+                    logging.warning("Import already applied despite %s, not resending", error or resp.status_code)
+                    return applied
+            delay = None if action in ("done", "fail") else self._retry_delay(attempt, resp)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return self._process_response(resp)
+
+            yield "sleep", delay
+            attempt += 1
+
+    def _request(self, method: str, endpoint: str, api_version: str = "v1", **kwargs):
+        self._refresh_jwt_token()
+        steps = self._request_steps(method, endpoint, api_version, kwargs)
+        result = None
+        while True:
+            try:
+                step, arg = steps.send(result)
+            except StopIteration as done:
+                return done.value
+            result = None
+            if step == "throttle":
+                result = self.rate_limiter.acquire()
+            elif step == "send":
+                try:
+                    result = self._send(method, endpoint, api_version, **kwargs), None
+                except self._transport_errors as e:
+                    result = None, e
+            elif step == "refresh":
+                self._refresh_jwt_token(rejected=arg)
+            elif step == "check":
+                try:
+                    result = self._import_applied(arg)
+                except Exception as e:
+                    result = e
+            else:
+                time.sleep(arg)
+
+    def _cached(self, endpoint: str, params, api_version: str, project):
+        """Cache key, TTL and cached response (or _MISSING) of a GET."""
+        key, ttl = self._cache_key(endpoint, params, api_version, project)
+        return key, ttl, self.cache.get(key, _MISSING) if key is not None else _MISSING
+
+    def _store(self, key, ttl, project, epoch: int, resp):
+        if project is not None:
+            resp = project(resp)
+        # A write that finished while this GET was in flight may have made resp stale.
+        if key is not None and epoch == self._epoch:
+            self.cache.set(key, resp, ttl)
+        return resp
+
+    def _written(self, resp):
+        # Any successful write (e.g. an import) can change every cached view of this portfolio.
+        self._epoch += 1
+        self.cache.clear((hash(self),))
+        return resp
+
+    def _get(self, endpoint: str, params=None, api_version: str = "v1", project=None):
+        """GET an endpoint; ``project`` trims the decoded response before it is cached."""
+        key, ttl, cached = self._cached(endpoint, params, api_version, project)
+        if cached is not _MISSING:
+            return cached
+        epoch = self._epoch
+        return self._store(key, ttl, project, epoch, self._request("GET", endpoint, api_version, params=params))
+
+    def _post(self, endpoint: str, data=None, api_version: str = "v1"):
+        return self._written(self._request("POST", endpoint, api_version, json=data))
+
+    def _process_response(self, resp):
         try:
             resp.raise_for_status()
-        except HTTPError as http_err:
+        except self._http_errors as http_err:
             logging.error(resp.text)
             raise http_err
 
-        return resp.json()
+        return orjson.loads(resp.content)
+
+    def close(self):
+        self._session.close()
 
     def orders(self, num=10, skip=0) -> dict:
         """Get all orders."""
@@ -78,12 +363,19 @@ class Ghostfolio:
     def holdings(self, date_range: str = "max") -> dict:
         return self._get("portfolio/holdings", params={"range": date_range})
 
-    def position(self, data_source: str, symbol: str):
-        """Get position for a symbol from a data source."""
-        return self._get(f"portfolio/position/{data_source}/{symbol}")
+    def position(self, data_source: str, symbol: str, full: bool = False):
+        """Get position for a symbol from a data source.
+
+        Unless full is set, the bulky orders and historicalData lists are dropped.
+        """
+        return self._get(f"portfolio/position/{data_source}/{symbol}", project=None if full else _SLIM_POSITION)
 
     def import_transactions(self, data: dict):
-        """Import transactions."""
+        """Import transactions.
+
+        When a failed attempt turns out to have been applied, the response lists the
+        matching existing orders instead of resending the import.
+        """
         return self._post("import", data)
 
     def details(self) -> dict:
@@ -119,3 +411,128 @@ class Ghostfolio:
     def __repr__(self):
         return f"Ghostfolio(host={self.host})"
 
+
+class AsyncGhostfolio(Ghostfolio):
+    """Asynchronous Ghostfolio API client.
+
+    All requests go through one pooled, keep-alive ``httpx.AsyncClient``, so the
+    endpoint methods inherited from ``Ghostfolio`` return coroutines and must be
+    awaited. ``concurrency`` caps the number of in-flight requests per endpoint.
+    """
+
+    _connect_errors = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+    _transport_errors = (httpx.TransportError,)
+    _http_errors = (httpx.HTTPStatusError,)
+
+    def __init__(self, token: str, host: str = "https://ghostfol.io/", timeouts: dict | None = None,
+                 cache_ttls: dict | None = None, cache: TTLCache | None = None,
+                 rate_limiter: TokenBucket | None = None, retry_policy: RetryPolicy | None = None,
+                 concurrency: dict | None = None, max_connections: int = 20,
+                 client: httpx.AsyncClient | None = None):
+        self._max_connections = max_connections
+        self._owns_client = client is None
+        self._client = client
+        super().__init__(token, host, timeouts, cache_ttls, cache, rate_limiter, retry_policy)
+        self._concurrency = {**DEFAULT_CONCURRENCY, **(concurrency or {})}
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+        self._jwt_refresh = SingleFlight("refresh JWT")
+        self._jwt_timer: asyncio.TimerHandle | None = None
+
+    def _new_session(self):
+        if self._client is not None:
+            return self._client
+        limits = httpx.Limits(max_connections=self._max_connections, max_keepalive_connections=self._max_connections)
+        return httpx.AsyncClient(limits=limits)
+
+    def _semaphore(self, endpoint: str) -> asyncio.Semaphore | None:
+        matches = [prefix for prefix in self._concurrency if endpoint.startswith(prefix)]
+        if not matches:
+            return None
+        prefix = max(matches, key=len)
+        if prefix not in self._semaphores:
+            self._semaphores[prefix] = asyncio.Semaphore(self._concurrency[prefix])
+        return self._semaphores[prefix]
+
+    async def _fetch_jwt_token(self):
+        resp = await self._session.post(
+            f"{self.host}/api/v1/auth/anonymous/", data={"accessToken": self.token},
+            timeout=self._timeout("auth/anonymous"),
+        )
+        self._set_jwt_token(self._process_response(resp)["authToken"])
+
+        # Renew in the background shortly before expiry instead of stalling a request on it.
+        if self._jwt_timer is not None:
+            self._jwt_timer.cancel()
+        delay = max(self._jwt_token_expiry - 2 * self._jwt_refresh_margin - datetime.now(), MIN_TOKEN_REFRESH_DELAY)
+        self._jwt_timer = asyncio.get_running_loop().call_later(delay.total_seconds(), self._refresh_jwt_in_background)
+
+    def _start_jwt_refresh(self) -> asyncio.Task:
+        # Every caller waits on the same in-flight refresh instead of issuing its own.
+        return self._jwt_refresh.run(self._fetch_jwt_token)
+
+    def _refresh_jwt_in_background(self):
+        self._start_jwt_refresh()
+
+    async def _refresh_jwt_token(self, rejected: str | None = None):
+        if self._token_is_fresh(rejected):
+            return
+        await asyncio.shield(self._start_jwt_refresh())
+
+    async def _send(self, method: str, endpoint: str, api_version: str, **kwargs):
+        semaphore = self._semaphore(endpoint)
+        if semaphore is None:
+            return await super()._send(method, endpoint, api_version, **kwargs)
+        async with semaphore:
+            return await super()._send(method, endpoint, api_version, **kwargs)
+
+    async def _import_applied(self, data: dict) -> dict | None:
+        check = _ImportCheck(data)
+        while not check.done:
+            check.add_page((await self.orders(num=IDEMPOTENCY_PAGE_SIZE, skip=check.skip)).get("activities", []))
+        return {"activities": check.matched} if check.applied else None
+
+    async def _request(self, method: str, endpoint: str, api_version: str = "v1", **kwargs):
+        await self._refresh_jwt_token()
+        steps = self._request_steps(method, endpoint, api_version, kwargs)
+        result = None
+        while True:
+            try:
+                step, arg = steps.send(result)
+            except StopIteration as done:
+                return done.value
+            result = None
+            if step == "throttle":
+                result = await self.rate_limiter.acquire_async()
+            elif step == "send":
+                try:
+                    result = await self._send(method, endpoint, api_version, **kwargs), None
+                except self._transport_errors as e:
+                    result = None, e
+            elif step == "refresh":
+                await self._refresh_jwt_token(rejected=arg)
+            elif step == "check":
+                try:
+                    result = await self._import_applied(arg)
+                except Exception as e:
+                    result = e
+            else:
+                await asyncio.sleep(arg)
+
+    async def _get(self, endpoint: str, params=None, api_version: str = "v1", project=None):
+        key, ttl, cached = self._cached(endpoint, params, api_version, project)
+        if cached is not _MISSING:
+            return cached
+        epoch = self._epoch
+        return self._store(key, ttl, project, epoch, await self._request("GET", endpoint, api_version, params=params))
+
+    async def _post(self, endpoint: str, data=None, api_version: str = "v1"):
+        return self._written(await self._request("POST", endpoint, api_version, json=data))
+
+    async def close(self):
+        if self._jwt_timer is not None:
+            self._jwt_timer.cancel()
+        if self._owns_client:
+            await self._session.aclose()
+
+    def __repr__(self):
+        return f"AsyncGhostfolio(host={self.host})"
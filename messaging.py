@@ -0,0 +1,50 @@
+import gzip
+import io
+import json
+
+from telegram import InputFile
+
+from metrics import METRICS
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Telegram rejects blank messages; sent instead so a reply markup still arrives.
+EMPTY_MESSAGE = "(nothing to show)"
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """Split text into chunks of at most limit characters, on line boundaries where possible."""
+    chunks, lines, size = [], [], 0
+    for line in text.splitlines(keepends=True):
+        if lines and size + len(line) > limit:
+            chunks.append("".join(lines))
+            lines, size = [], 0
+        # A single line longer than the limit is cut hard.
+        while len(line) > limit:
+            chunks.append(line[:limit])
+            line = line[limit:]
+        lines.append(line)
+        size += len(line)
+    if lines:
+        chunks.append("".join(lines))
+    return chunks or [text]
+
+
+async def send_text(context, chat_id: int, text: str, reply_markup=None):
+    """Send text of any length as one or more messages; the markup goes on the last one."""
+    chunks = [chunk for chunk in split_message(text) if chunk.strip()] or [EMPTY_MESSAGE]
+    with METRICS.timer("telegram:send_text"):
+        for index, chunk in enumerate(chunks):
+            await context.bot.send_message(chat_id=chat_id, text=chunk,
+                                           reply_markup=reply_markup if index == len(chunks) - 1 else None)
+
+
+async def send_json(context, chat_id: int, data, name: str = "data"):
+    """Send data as JSON, falling back to a gzip compressed document when it does not fit a message."""
+    text = json.dumps(data, indent=2)
+    with METRICS.timer("telegram:send_json"):
+        if len(text) <= TELEGRAM_MESSAGE_LIMIT:
+            await context.bot.send_message(chat_id=chat_id, text=text)
+            return
+
+        document = InputFile(io.BytesIO(gzip.compress(text.encode())), filename=f"{name}.json.gz")
+        await context.bot.send_document(chat_id=chat_id, document=document)
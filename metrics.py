@@ -0,0 +1,128 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+import numpy as np
+
+DEFAULT_WINDOW = 1000
+QUANTILES = (50, 95, 99)
+
+
+class Metrics:
+    """Latency samples and error counters per operation name.
+
+    Names are prefixed by layer, e.g. "handler:holdings", "ghostfolio:GET portfolio/holdings"
+    or "chart:render". Percentiles are computed over the last ``window`` samples.
+    """
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._samples: dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._counts = Counter()
+        self._errors = Counter()
+        self.caches = {}
+        self.counters = {}
+
+    def observe(self, name: str, seconds: float, error: bool = False):
+        self._samples[name].append(seconds)
+        self._counts[name] += 1
+        if error:
+            self._errors[name] += 1
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, error)
+
+    def summary(self) -> list[dict]:
+        rows = []
+        for name in sorted(self._samples):
+            p50, p95, p99 = np.percentile(np.fromiter(self._samples[name], dtype=float), QUANTILES)
+            rows.append({"name": name, "count": self._counts[name], "errors": self._errors[name],
+                         "p50": p50, "p95": p95, "p99": p99})
+        return rows
+
+    def register_cache(self, name: str, cache):
+        """Report hit/miss counters of a cache exposing stats()."""
+        self.caches[name] = cache
+
+    def register_counters(self, name: str, counters: dict):
+        """Report a dict of numeric counters, e.g. AsyncGhostfolio.metrics."""
+        self.counters[name] = counters
+
+    def report(self) -> str:
+        lines = ["Latency (ms)  count errors p50 / p95 / p99"]
+        for row in self.summary():
+            lines.append(f"{row['name']}: {row['count']} {row['errors']} "
+                         f"{row['p50'] * 1000:.0f} / {row['p95'] * 1000:.0f} / {row['p99'] * 1000:.0f}")
+        if self.caches:
+            lines.append("")
+            lines.append("Cache hit rate")
+            for name, cache in self.caches.items():
+                stats = cache.stats()
+                lines.append(f"{name}: {stats['hit_rate'] * 100:.1f}% ({stats['hits']} hits, {stats['misses']} misses)")
+        for name, counters in self.counters.items():
+            lines.append("")
+            lines.append(name)
+            lines += [f"{key}: {round(value, 3)}" for key, value in counters.items()]
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines = ["# TYPE ghostfolio_bot_latency_seconds summary"]
+        for row in self.summary():
+            label = f'name="{row["name"]}"'
+            for quantile in QUANTILES:
+                lines.append(f'ghostfolio_bot_latency_seconds{{{label},quantile="{quantile / 100}"}} {row[f"p{quantile}"]}')
+            lines.append(f"ghostfolio_bot_latency_seconds_count{{{label}}} {row['count']}")
+        lines.append("# TYPE ghostfolio_bot_errors_total counter")
+        for row in self.summary():
+            lines.append(f'ghostfolio_bot_errors_total{{name="{row["name"]}"}} {row["errors"]}')
+        lines.append("# TYPE ghostfolio_bot_cache_requests_total counter")
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            lines.append(f'ghostfolio_bot_cache_requests_total{{cache="{name}",result="hit"}} {stats["hits"]}')
+            lines.append(f'ghostfolio_bot_cache_requests_total{{cache="{name}",result="miss"}} {stats["misses"]}')
+        for name, counters in self.counters.items():
+            for key, value in counters.items():
+                lines.append(f'ghostfolio_bot_{key}{{source="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    async def serve_prometheus(self, host: str, port: int) -> asyncio.AbstractServer:
+        """Serve prometheus() over plain HTTP on host:port."""
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+                body = self.prometheus().encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as e:
+                logging.debug("Bad metrics request: %s", e)
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+
+METRICS = Metrics()
+
+
+def timed(name: str):
+    """Record the latency and failures of an async handler under "handler:<name>"."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with METRICS.timer(f"handler:{name}"):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
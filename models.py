@@ -0,0 +1,92 @@
+class Model:
+    """Slim, read-only view over a Ghostfolio response object.
+
+    Subclasses list the attributes they keep in ``__slots__`` and where each
+    comes from in ``_fields``: a response key, or a tuple of keys for nested
+    values. Everything else in the response is dropped.
+    """
+
+    __slots__ = ()
+    _fields: dict[str, str | tuple[str, ...]] = {}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        obj = cls.__new__(cls)
+        for name in cls.__slots__:
+            path = cls._fields[name]
+            value = data
+            for key in (path,) if isinstance(path, str) else path:
+                value = value.get(key) if isinstance(value, dict) else None
+            setattr(obj, name, value)
+        return obj
+
+    @classmethod
+    def from_list(cls, items: list[dict]) -> list:
+        return [cls.from_dict(item) for item in items]
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+class Account(Model):
+    __slots__ = ("name", "currency", "value", "value_in_base_currency")
+    _fields = {
+        "name": "name",
+        "currency": "currency",
+        "value": "value",
+        "value_in_base_currency": "valueInBaseCurrency",
+    }
+
+
+class Holding(Model):
+    __slots__ = ("name", "symbol", "data_source", "currency", "quantity", "market_price",
+                 "value_in_base_currency", "allocation_in_percentage")
+    _fields = {
+        "name": "name",
+        "symbol": "symbol",
+        "data_source": "dataSource",
+        "currency": "currency",
+        "quantity": "quantity",
+        "market_price": "marketPrice",
+        "value_in_base_currency": "valueInBaseCurrency",
+        "allocation_in_percentage": "allocationInPercentage",
+    }
+
+
+class Position(Model):
+    __slots__ = ("name", "symbol", "data_source", "currency", "market_price", "quantity",
+                 "investment", "value", "net_performance")
+    _fields = {
+        "name": ("SymbolProfile", "name"),
+        "symbol": ("SymbolProfile", "symbol"),
+        "data_source": ("SymbolProfile", "dataSource"),
+        "currency": ("SymbolProfile", "currency"),
+        "market_price": "marketPrice",
+        "quantity": "quantity",
+        "investment": "investment",
+        "value": "value",
+        "net_performance": "netPerformance",
+    }
+
+
+def activity_key(activity: dict) -> tuple:
+    """Identity of an activity, shared by import payloads and orders returned by the API."""
+    symbol = activity.get("symbol") or activity.get("SymbolProfile", {}).get("symbol")
+    return (
+        activity["date"][:10],
+        symbol,
+        activity["type"],
+        round(float(activity["quantity"]), 8),
+        round(float(activity["unitPrice"]), 8),
+        activity.get("accountId"),
+    )
+
+
+def drop_keys(*keys: str):
+    """Projection that removes the given top-level keys from a response."""
+    def project(resp: dict) -> dict:
+        return {key: value for key, value in resp.items() if key not in keys}
+    return project
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import Counter
+
+from models import activity_key
+
+DEFAULT_DB_PATH = os.getenv("ORDER_DB_PATH", "orders.db")
+SYNC_PAGE_SIZE = 100
+# Full syncs repeated because orders changed while paging, before giving up on pruning.
+FULL_SYNC_ATTEMPTS = 3
+# Orders edited or deleted in Ghostfolio itself are only noticed by a full sync, so run one at least this often.
+DEFAULT_FULL_SYNC_INTERVAL = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    type TEXT,
+    symbol TEXT,
+    name TEXT,
+    account TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_date ON orders (date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS orders_symbol ON orders (symbol, date DESC);
+CREATE INDEX IF NOT EXISTS orders_account ON orders (account, date DESC);
+CREATE TABLE IF NOT EXISTS synced (
+    kind TEXT PRIMARY KEY,
+    at REAL NOT NULL
+);
+"""
+
+
+class OrderStore:
+    """Local SQLite copy of the Ghostfolio order history.
+
+    ``sync`` only fetches orders newer than the newest one already stored, and
+    paging, filtering and search are served from disk with a (date, id) cursor.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, full_sync_interval: float = DEFAULT_FULL_SYNC_INTERVAL):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self.full_sync_interval = full_sync_interval
+        self.needs_full_sync = False
+        # Incremented whenever a sync changes the stored orders, so readers can tell their copy is stale.
+        self.version = 0
+
+    def _insert(self, activities: list[dict]):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO orders (id, date, type, symbol, name, account, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    activity["id"],
+                    activity["date"],
+                    activity["type"],
+                    activity.get("SymbolProfile", {}).get("symbol"),
+                    activity.get("SymbolProfile", {}).get("name"),
+                    activity.get("Account", {}).get("name"),
+                    json.dumps(activity),
+                )
+                for activity in activities
+            ],
+        )
+
+    def _stored(self, ids: list[str]) -> dict[str, str]:
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        return dict(self._db.execute(f"SELECT id, data FROM orders WHERE id IN ({placeholders})", ids))
+
+    def _full_sync_due(self) -> bool:
+        row = self._db.execute("SELECT at FROM synced WHERE kind = 'full'").fetchone()
+        return row is None or time.time() - row[0] >= self.full_sync_interval
+
+    async def _walk(self, ghost, full: bool) -> tuple[list[str], int, int | None]:
+        """Fetch pages newest first; returns the ids seen, the number of new or edited orders and the first page's count."""
+        seen, changed, skip, count = [], 0, 0, None
+        while True:
+            resp = await ghost.orders(num=SYNC_PAGE_SIZE, skip=skip)
+            activities = resp.get("activities", [])
+            if count is None:
+                count = resp.get("count")
+            stored = self._stored([activity["id"] for activity in activities])
+            # Only a full sync rewrites known orders, picking up edits made in Ghostfolio.
+            updated = [
+                activity for activity in activities
+                if activity["id"] not in stored or (full and stored[activity["id"]] != json.dumps(activity))
+            ]
+            with self._db:
+                self._insert(updated)
+            seen += [activity["id"] for activity in activities]
+            changed += len(updated)
+            if (stored and not full) or len(activities) < SYNC_PAGE_SIZE:
+                return seen, changed, count
+            skip += len(activities)
+
+    async def sync(self, ghost, full: bool = False) -> int:
+        """Fetch orders newest-first until an already stored one is reached; returns the number of changes.
+
+        A full sync walks the whole history, rewrites edited orders and drops
+        orders deleted upstream; it runs after imports (which can add orders older
+        than the newest one), when asked for and every full_sync_interval seconds.
+        Orders added or deleted during the walk shift the skip offsets, so the walk
+        is repeated until the ids seen match the count before and after it, and
+        nothing is dropped if it never does.
+        """
+        full = full or self.needs_full_sync or self._full_sync_due()
+        changed = 0
+        for _ in range(FULL_SYNC_ATTEMPTS if full else 1):
+            seen, fetched, count = await self._walk(ghost, full)
+            changed += fetched
+            self.version += bool(fetched)
+            if not full:
+                return changed
+            after = (await ghost.orders(num=1)).get("count")
+            if count is None or count == after == len(seen) == len(set(seen)):
+                break
+            logging.info("Orders changed during full sync (%s, then %s, saw %d), retrying", count, after, len(seen))
+        else:
+            logging.warning("Orders kept changing during full sync, not dropping deleted orders")
+            return changed
+
+        with self._db:
+            self._db.execute("CREATE TEMP TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY)")
+            self._db.execute("DELETE FROM seen")
+            self._db.executemany("INSERT OR IGNORE INTO seen (id) VALUES (?)", [(order_id,) for order_id in seen])
+            deleted = self._db.execute("DELETE FROM orders WHERE id NOT IN (SELECT id FROM seen)").rowcount
+            self._db.execute("INSERT OR REPLACE INTO synced (kind, at) VALUES ('full', ?)", (time.time(),))
+        self.needs_full_sync = False
+        self.version += bool(deleted)
+        return changed + deleted
+
+    def page(self, cursor: tuple[str, str] | None = None, limit: int = 10, symbol: str | None = None,
+             account: str | None = None, search: str | None = None) -> tuple[list[dict], tuple[str, str] | None]:
+        """Return up to limit orders older than cursor, newest first, and the cursor of the next page."""
+        clauses, params = [], []
+        if cursor is not None:
+            clauses.append("(date, id) < (?, ?)")
+            params += cursor
+        if symbol is not None:
+            clauses.append("symbol = ?")
+            params.append(symbol)
+        if account is not None:
+            clauses.append("account = ?")
+            params.append(account)
+        if search:
+            clauses.append("(symbol LIKE ? OR name LIKE ? OR account LIKE ? OR type LIKE ?)")
+            params += [f"%{search}%"] * 4
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._db.execute(
+            f"SELECT date, id, data FROM orders {where} ORDER BY date DESC, id DESC LIMIT ?", params + [limit + 1]
+        ).fetchall()
+
+        next_cursor = (rows[limit - 1][0], rows[limit - 1][1]) if len(rows) > limit else None
+        return [json.loads(row[2]) for row in rows[:limit]], next_cursor
+
+    def activities(self) -> list[dict]:
+        """Every stored order, oldest first."""
+        return [json.loads(row[0]) for row in self._db.execute("SELECT data FROM orders ORDER BY date, id")]
+
+    def keys(self) -> Counter:
+        """Number of stored orders per models.activity_key."""
+        return Counter(activity_key(json.loads(row[0])) for row in self._db.execute("SELECT data FROM orders"))
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+DEFAULT_DB_PATH = os.getenv("PERIOD_DB_PATH", "periods.db")
+# Totals younger than this are served without asking Ghostfolio.
+DEFAULT_SYNC_INTERVAL = 3600
+KINDS = ("dividends", "investments")
+ROLLUPS = ("month", "quarter", "year")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS periods (
+    kind TEXT NOT NULL,
+    month TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (kind, month)
+);
+CREATE TABLE IF NOT EXISTS synced (
+    kind TEXT PRIMARY KEY,
+    at REAL NOT NULL
+);
+"""
+
+
+def rollup(months: np.ndarray, amounts: np.ndarray, by: str) -> tuple[list[str], np.ndarray]:
+    """Sum monthly amounts (months as datetime64[M], ascending) per month, quarter or year."""
+    if by == "month":
+        return [str(month) for month in months], amounts
+    if by == "quarter":
+        index = months.astype(int) // 3
+        labels = [f"{1970 + i // 4}-Q{i % 4 + 1}" for i in np.unique(index)]
+    elif by == "year":
+        index = months.astype("datetime64[Y]").astype(int)
+        labels = [str(1970 + i) for i in np.unique(index)]
+    else:
+        raise ValueError(f"Unknown rollup {by}")
+    _, groups = np.unique(index, return_inverse=True)
+    return labels, np.bincount(groups, weights=amounts)
+
+
+class PeriodStore:
+    """Local SQLite copy of Ghostfolio's monthly dividend and investment totals.
+
+    ``sync`` refetches only the years from the last stored month on (the open
+    month may still change), and month, quarter and year rollups are computed
+    from the stored series without another request.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, sync_interval: float = DEFAULT_SYNC_INTERVAL):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self.sync_interval = sync_interval
+        self._stale: set[str] = set()
+
+    def _last_month(self, kind: str) -> str | None:
+        return self._db.execute("SELECT MAX(month) FROM periods WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def _synced_at(self, kind: str) -> float | None:
+        row = self._db.execute("SELECT at FROM synced WHERE kind = ?", (kind,)).fetchone()
+        return row[0] if row else None
+
+    async def _fetch(self, ghost, kind: str, date_range: str) -> list[dict]:
+        if kind == "dividends":
+            return (await ghost.dividends("month", date_range)).get("dividends", [])
+        return (await ghost.investments("month", date_range)).get("investments", [])
+
+    async def sync(self, ghost, kind: str, force: bool = False) -> bool:
+        """Bring one series up to date; returns whether Ghostfolio was asked."""
+        synced_at = self._synced_at(kind)
+        full = kind in self._stale or synced_at is None
+        if not (full or force) and time.time() - synced_at < self.sync_interval:
+            return False
+
+        last = None if full else self._last_month(kind)
+        if last is None:
+            ranges, since = ["max"], ""
+        else:
+            ranges = [str(year) for year in range(int(last[:4]), time.localtime().tm_year + 1)]
+            since = f"{last[:4]}-01"
+
+        responses = await asyncio.gather(*(self._fetch(ghost, kind, date_range) for date_range in ranges))
+        rows = [(kind, item["date"][:7], item["investment"]) for items in responses for item in items]
+
+        with self._db:
+            self._db.execute("DELETE FROM periods WHERE kind = ? AND month >= ?", (kind, since))
+            self._db.executemany("INSERT OR REPLACE INTO periods (kind, month, amount) VALUES (?, ?, ?)", rows)
+            self._db.execute("INSERT OR REPLACE INTO synced (kind, at) VALUES (?, ?)", (kind, time.time()))
+        self._stale.discard(kind)
+        return True
+
+    def series(self, kind: str) -> tuple[np.ndarray, np.ndarray]:
+        rows = self._db.execute("SELECT month, amount FROM periods WHERE kind = ? ORDER BY month", (kind,)).fetchall()
+        months = np.array([row[0] for row in rows], dtype="datetime64[M]")
+        amounts = np.fromiter((row[1] for row in rows), dtype=float, count=len(rows))
+        return months, amounts
+
+    def totals(self, kind: str, by: str = "year") -> tuple[list[str], np.ndarray]:
+        return rollup(*self.series(kind), by)
+
+    def invalidate(self):
+        """Refetch everything on the next sync, e.g. after an import changed past periods."""
+        self._stale = set(KINDS)
+
+    def close(self):
+        self._db.close()
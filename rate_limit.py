@@ -0,0 +1,77 @@
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class TokenBucket:
+    """Token bucket allowing ``rate`` requests per second with bursts up to ``capacity``.
+
+    ``acquire`` reserves a token and sleeps until it is available; it returns
+    the seconds spent waiting so callers can report throttling.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self) -> float:
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait according to a Retry-After header (delta seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff with full jitter, capped at max_backoff seconds.
+
+    A Retry-After header from the server takes precedence; if it asks for
+    more than max_retry_after seconds the request is not retried at all.
+    """
+    max_retries: int = 3
+    backoff: float = 0.5
+    max_backoff: float = 30.0
+    max_retry_after: float = 120.0
+
+    def delay(self, attempt: int, retry_after: str | None = None) -> float | None:
+        if attempt >= self.max_retries:
+            return None
+        server_delay = parse_retry_after(retry_after)
+        if server_delay is not None:
+            return server_delay if server_delay <= self.max_retry_after else None
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import httpx
+
+from analytics import PortfolioAnalytics
+from cache import TTLCache
+from ghostfolio import DEFAULT_RATE_LIMIT, AsyncGhostfolio
+from order_store import DEFAULT_DB_PATH, OrderStore
+from period_store import DEFAULT_DB_PATH as DEFAULT_PERIOD_DB_PATH, PeriodStore
+from rate_limit import TokenBucket
+from snapshot import DEFAULT_MAX_AGE, PortfolioSnapshot
+from symbol_registry import SymbolRegistry
+from tasks import background
+
+DEFAULT_MAX_SESSIONS = 500
+# Sessions idle for longer are skipped by refresh_all, so inactive portfolios cost no requests.
+DEFAULT_ACTIVE_WINDOW = 3600
+# Sessions used more recently are never evicted, since a handler may still be using their stores.
+DEFAULT_IDLE_GRACE = 900
+
+
+def session_db_path(ghost: AsyncGhostfolio, path: str = DEFAULT_DB_PATH) -> str:
+    """Per-portfolio database next to path, named by a stable digest of token and host."""
+    if path == ":memory:":
+        return path
+    digest = hashlib.sha256(f"{ghost.host}\0{ghost.token}".encode()).hexdigest()[:16]
+    root, ext = os.path.splitext(path)
+    return f"{root}-{digest}{ext}"
+
+
+@dataclass(eq=False)
+class Session:
+    """A Ghostfolio client and the derived state kept for its portfolio."""
+
+    ghost: AsyncGhostfolio
+    symbols: SymbolRegistry
+    snapshot: PortfolioSnapshot
+    orders: OrderStore
+    analytics: PortfolioAnalytics
+    periods: PeriodStore
+    last_used: float = field(default_factory=time.monotonic)
+
+    async def close(self):
+        await self.ghost.close()
+        self.orders.close()
+        self.periods.close()
+
+
+class SessionPool:
+    """Sessions for every portfolio the bot serves, keyed by (token, host).
+
+    All clients share one HTTP connection pool and one response cache (keys are
+    namespaced per client), and clients for the same host share a rate limiter.
+    Once more than ``max_sessions`` are open, the least recently used sessions
+    idle for at least ``idle_grace`` seconds are closed; their orders and period
+    totals stay on disk for the next login. Until enough sessions are idle the
+    pool grows past the limit rather than closing a store still in use.
+    """
+
+    def __init__(self, max_sessions: int = DEFAULT_MAX_SESSIONS, max_connections: int = 100,
+                 snapshot_max_age: float = DEFAULT_MAX_AGE, cache_size: int = 4096, db_path: str = DEFAULT_DB_PATH,
+                 period_db_path: str = DEFAULT_PERIOD_DB_PATH, idle_grace: float = DEFAULT_IDLE_GRACE):
+        self.max_sessions = max_sessions
+        self.idle_grace = idle_grace
+        self.db_path = db_path
+        self.period_db_path = period_db_path
+        self.snapshot_max_age = snapshot_max_age
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = httpx.AsyncClient(limits=limits)
+        self.cache = TTLCache(maxsize=cache_size)
+        self.metrics = {"requests": 0, "retries": 0, "retry_wait": 0.0, "throttle_wait": 0.0}
+        self.on_request = None
+        self._rate_limiters: dict[str, TokenBucket] = {}
+        self._sessions: OrderedDict[tuple[str, str], Session] = OrderedDict()
+
+    def _rate_limiter(self, host: str) -> TokenBucket:
+        return self._rate_limiters.setdefault(host, TokenBucket(*DEFAULT_RATE_LIMIT))
+
+    def _new_session(self, token: str, host: str) -> Session:
+        ghost = AsyncGhostfolio(token=token, host=host, cache=self.cache, rate_limiter=self._rate_limiter(host),
+                                client=self.client)
+        ghost.metrics = self.metrics
+        ghost.on_request = self.on_request
+        orders = OrderStore(session_db_path(ghost, self.db_path))
+        return Session(
+            ghost=ghost,
+            symbols=SymbolRegistry(ghost),
+            snapshot=PortfolioSnapshot(ghost, max_age=self.snapshot_max_age),
+            orders=orders,
+            analytics=PortfolioAnalytics(ghost, orders),
+            periods=PeriodStore(session_db_path(ghost, self.period_db_path)),
+        )
+
+    async def verify(self, token: str, host: str):
+        """Raise unless token logs in to host, without opening a session (or its databases) for it."""
+        if (token, host) in self._sessions:
+            return
+        ghost = AsyncGhostfolio(token=token, host=host, rate_limiter=self._rate_limiter(host), client=self.client)
+        try:
+            await ghost.accounts()
+        finally:
+            await ghost.close()
+
+    def get(self, token: str, host: str) -> Session:
+        key = (token, host)
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = self._new_session(token, host)
+        self._sessions.move_to_end(key)
+        session.last_used = time.monotonic()
+        self._evict()
+        return session
+
+    def _evict(self):
+        excess = len(self._sessions) - self.max_sessions
+        if excess <= 0:
+            return
+        idle_since = time.monotonic() - self.idle_grace
+        # Oldest first, and last_used only grows towards the end, so stop at the first busy one.
+        for key, session in list(self._sessions.items())[:excess]:
+            if session.last_used > idle_since:
+                break
+            del self._sessions[key]
+            background(session.close(), "close session")
+
+    async def discard(self, token: str, host: str):
+        session = self._sessions.pop((token, host), None)
+        if session is not None:
+            self.cache.clear((hash(session.ghost),))
+            await session.close()
+
+    async def refresh_all(self, active_window: float = DEFAULT_ACTIVE_WINDOW):
+        """Refresh the snapshots of sessions used within the last active_window seconds."""
+        now = time.monotonic()
+        await asyncio.gather(*(
+            session.snapshot.refresh_all()
+            for session in list(self._sessions.values())
+            if now - session.last_used <= active_window
+        ))
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+        await self.client.aclose()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from tasks import SingleFlight
+
+DEFAULT_MAX_AGE = 60
+DEFAULT_PERFORMANCE_RANGES = ("ytd", "1y", "max")
+
+
+class PortfolioSnapshot:
+    """In-memory copy of the portfolio views the bot reads most.
+
+    Views are prefetched by ``refresh_all`` (run periodically from the job
+    queue) and served with stale-while-revalidate semantics: a view older than
+    ``max_age`` seconds is still returned immediately while a background
+    request refreshes it. Only a view that was never loaded waits on the API.
+    """
+
+    def __init__(self, ghost, max_age: float = DEFAULT_MAX_AGE, performance_ranges=DEFAULT_PERFORMANCE_RANGES):
+        self._ghost = ghost
+        self.max_age = max_age
+        self.performance_ranges = performance_ranges
+        self._entries: dict[tuple, tuple[float, dict]] = {}
+        self._loading = SingleFlight("refresh portfolio snapshot")
+        self._generation = 0
+
+    def _fetch(self, key: tuple):
+        name, *args = key
+        return {
+            "accounts": self._ghost.accounts,
+            "details": self._ghost.details,
+            "holdings": self._ghost.holdings,
+            "performance": self._ghost.performance,
+        }[name](*args)
+
+    async def _load(self, key: tuple) -> dict:
+        generation = self._generation
+        resp = await self._fetch(key)
+        # A load that started before invalidate() may hold pre-import data.
+        if generation == self._generation:
+            self._entries[key] = (time.monotonic(), resp)
+        return resp
+
+    def _revalidate(self, key: tuple) -> asyncio.Task:
+        # Requests for the same view share one in-flight load.
+        return self._loading.run(lambda: self._load(key), key)
+
+    async def get(self, name: str, *args) -> dict:
+        key = (name, *args)
+        entry = self._entries.get(key)
+        if entry is None:
+            return await self._revalidate(key)
+
+        if time.monotonic() - entry[0] > self.max_age:
+            self._revalidate(key)
+        return entry[1]
+
+    def keys(self) -> list[tuple]:
+        keys = [("accounts",), ("details",), ("holdings",)]
+        keys += [("performance", date_range) for date_range in self.performance_ranges]
+        return keys
+
+    async def refresh_all(self):
+        await asyncio.gather(*(self._revalidate(key) for key in self.keys()), return_exceptions=True)
+
+    def invalidate(self):
+        """Drop every view, e.g. after an import changed the portfolio."""
+        self._generation += 1
+        self._entries.clear()
+        self._loading.clear()
@@ -0,0 +1,130 @@
+import codecs
+import json
+import logging
+import os
+import time
+
+import requests
+from lxml import etree
+
+ISIN_URL = "https://isin.twse.com.tw/isin/C_public.jsp?strMode={mode}"
+# strMode=2 lists TWSE (上市) stocks, strMode=4 lists TPEx (上櫃) stocks.
+ISIN_MODES = ("2", "4")
+ISIN_ENCODING = "cp950"
+SUFFIXES = {"上市": ".TW", "上櫃": ".TWO"}
+
+DEFAULT_PATH = os.getenv("STOCK_MAP_PATH", "stock_map.json")
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def parse_isin_html(chunks, encoding: str = ISIN_ENCODING) -> dict[str, str]:
+    """Stream-parse an ISIN listing page into a stock name -> Yahoo symbol map.
+
+    ``chunks`` is any iterable of bytes, e.g. ``response.iter_content()`` or an
+    open file, so rows are handled as they arrive and freed right after.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    parser = etree.HTMLPullParser(events=("end",), tag="tr")
+    stock_map = {}
+
+    def handle_rows():
+        for _, row in parser.read_events():
+            cols = row.findall("td")
+            if len(cols) >= 4:
+                code, _, name = "".join(cols[0].itertext()).strip().partition("　")
+                suffix = SUFFIXES.get("".join(cols[3].itertext()).strip())
+                if code and code[0].isdigit() and suffix:  # 確保是股票代碼
+                    stock_map[name.strip()] = code.strip() + suffix
+            row.clear()
+            while row.getprevious() is not None:
+                del row.getparent()[0]
+
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+        handle_rows()
+    parser.feed(decoder.decode(b"", final=True))
+    parser.close()
+    handle_rows()
+    return stock_map
+
+
+class StockMap:
+    """TWSE/TPEx stock name -> symbol map persisted as JSON.
+
+    Each ISIN listing is refreshed on its own once older than ``max_age``
+    seconds. When a download fails the last saved listing keeps being used.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, max_age: float = DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._listings: dict[str, dict[str, str]] = {}
+        self._updated: dict[str, float] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._listings = data["listings"]
+            self._updated = data["updated"]
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("Ignoring unreadable stock map %s: %s", self.path, e)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"updated": self._updated, "listings": self._listings}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def is_stale(self, mode: str) -> bool:
+        return time.time() - self._updated.get(mode, 0) > self.max_age
+
+    def load_html(self, mode: str, file):
+        """Replace one listing with a local copy of its ISIN page, e.g. a test fixture."""
+        if isinstance(file, str):
+            with open(file, "rb") as f:
+                return self.load_html(mode, f)
+
+        self._listings[mode] = parse_isin_html(iter(lambda: file.read(64 * 1024), b""))
+        self._updated[mode] = time.time()
+
+    def refresh(self, force: bool = False) -> "StockMap":
+        """Download the stale listings and persist the result."""
+        changed = False
+        for mode in ISIN_MODES:
+            if not force and not self.is_stale(mode):
+                continue
+            try:
+                with requests.get(ISIN_URL.format(mode=mode), stream=True, timeout=30) as response:
+                    response.raise_for_status()
+                    listing = parse_isin_html(response.iter_content(64 * 1024))
+            except requests.RequestException as e:
+                logging.warning("Using cached ISIN listing %s: %s", mode, e)
+                continue
+            if not listing:
+                logging.warning("ISIN listing %s is empty, keeping cached copy", mode)
+                continue
+            self._listings[mode] = listing
+            self._updated[mode] = time.time()
+            changed = True
+
+        if changed:
+            self.save()
+        return self
+
+    def as_dict(self) -> dict[str, str]:
+        merged = {}
+        for mode in ISIN_MODES:
+            merged.update(self._listings.get(mode, {}))
+        return merged
+
+    def __len__(self) -> int:
+        return sum(len(listing) for listing in self._listings.values())
+
+
+if __name__ == "__main__":
+    stock_map = StockMap().refresh(force=True)
+    print(f"Saved {len(stock_map)} stocks to {stock_map.path}")
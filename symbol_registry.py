@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from tasks import SingleFlight
+
+DATA_SOURCES = ("YAHOO", "COINGECKO")
+
+
+class SymbolRegistry:
+    """Index of held symbols and their data source (YAHOO, COINGECKO, ...).
+
+    Built from the holdings endpoint and refreshed in the background once it is
+    older than ``ttl`` seconds, or right after an import via ``invalidate``.
+    """
+
+    def __init__(self, ghost, ttl: float = 600):
+        self._ghost = ghost
+        self.ttl = ttl
+        self._sources: dict[str, str] = {}
+        self._updated: float | None = None
+        self._refresh = SingleFlight("refresh symbol registry")
+        self._generation = 0
+
+    async def refresh(self):
+        generation = self._generation
+        resp = await self._ghost.holdings()
+        if "holdings" not in resp:
+            raise ValueError("Unexpected holdings response")
+        # A refresh that started before invalidate() may miss newly imported symbols.
+        if generation != self._generation:
+            return
+
+        self._sources = {
+            holding["symbol"]: holding.get("dataSource", "YAHOO")
+            for holding in resp["holdings"]
+            if holding.get("symbol")
+        }
+        self._updated = time.monotonic()
+
+    def _schedule_refresh(self) -> asyncio.Task:
+        # Concurrent callers share the refresh that is already in flight.
+        return self._refresh.run(self.refresh)
+
+    def is_stale(self) -> bool:
+        return self._updated is None or time.monotonic() - self._updated > self.ttl
+
+    async def ensure_loaded(self):
+        """Wait for the first load; afterwards only refresh stale data in the background."""
+        if self._updated is None:
+            await self._schedule_refresh()
+        elif self.is_stale():
+            self._schedule_refresh()
+
+    def invalidate(self):
+        """Refresh in the background, e.g. after new transactions were imported."""
+        self._generation += 1
+        self._refresh.clear()
+        self._schedule_refresh()
+
+    async def _probe(self, data_source: str, symbol: str):
+        return data_source, await self._ghost.position(data_source, symbol)
+
+    async def position(self, symbol: str, data_sources=DATA_SOURCES) -> dict:
+        """Get the position of symbol, or {} if no data source knows it.
+
+        The known data source is asked first. Otherwise all candidates are queried
+        concurrently, the first answer with a SymbolProfile wins, the remaining
+        requests are cancelled and the winner is remembered for the next lookup.
+        """
+        known = self._sources.get(symbol)
+        if known is not None:
+            resp = await self._ghost.position(known, symbol)
+            if "SymbolProfile" in resp:
+                return resp
+
+        pending = {asyncio.create_task(self._probe(source, symbol)) for source in data_sources if source != known}
+        errors = []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                        continue
+                    source, resp = task.result()
+                    if "SymbolProfile" in resp:
+                        self._sources[symbol] = source
+                        return resp
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if errors and len(errors) == len(data_sources) - (known in data_sources):
+            raise errors[0]
+        return {}
+
+    def data_source(self, symbol: str) -> str | None:
+        return self._sources.get(symbol)
+
+    def symbols(self) -> list[str]:
+        return list(self._sources)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._sources
+
+    def __len__(self) -> int:
+        return len(self._sources)
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+
+
+def log_failure(what: str):
+    """Done callback logging a background task's exception as "Failed to <what>"."""
+    def callback(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error("Failed to %s: %s", what, task.exception())
+    return callback
+
+
+def background(coro, what: str) -> asyncio.Task:
+    """Run coro as a task nobody has to await; its failure is logged."""
+    task = asyncio.create_task(coro)
+    task.add_done_callback(log_failure(what))
+    return task
+
+
+class SingleFlight:
+    """At most one in-flight task per key; concurrent callers share it.
+
+    Failures are logged, so callers that only want the work done in the
+    background do not need to await the task.
+    """
+
+    def __init__(self, what: str):
+        self.what = what
+        self._tasks: dict = {}
+
+    def run(self, factory, key=None) -> asyncio.Task:
+        """The running task for key, or a new one from factory()."""
+        task = self._tasks.get(key)
+        if task is None or task.done():
+            task = self._tasks[key] = background(factory(), self.what)
+        return task
+
+    def clear(self):
+        """Forget running tasks, so the next run starts fresh ones."""
+        self._tasks.clear()
@@ -1,14 +1,26 @@
+import asyncio
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
-
-from ghostfolio import Ghostfolio
-from data_importer import DataImporter
+from telegram.error import TelegramError
+from telegram.ext import AIORateLimiter, ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, TypeHandler
+
+from data_importer import DEFAULT_CHUNK_SIZE, MAX_UPLOAD_BYTES, MAX_UPLOAD_FILES, parse_uploads
+from bulk_import import DEFAULT_BATCH_SIZE, drop_existing, flatten, import_in_chunks, preview, report
+from charts import ChartRenderer
+from models import Account, Holding, Position
+from sessions import Session, SessionPool
+from analytics import DEFAULT_RANGES
+from period_store import ROLLUPS
+from alerts import MAX_ALERT_INTERVAL, MIN_ALERT_INTERVAL, AlertBook
+from update_processor import DEFAULT_CONCURRENT_UPDATES, PerChatUpdateProcessor
+from messaging import send_json, send_text
+from metrics import METRICS, timed
 import json
-import matplotlib.pyplot as plt
 import os
+from urllib.parse import urlsplit
 
-holding_list = []
 STAGE1, STAGE2, STAGE3, STAGE4 = range(4)
 
 logging.basicConfig(
@@ -16,15 +28,88 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+def credentials_for(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> tuple[str, str] | None:
+    """The user's own Ghostfolio login, or the bot's default account if they are allowed to use it.
+
+    context.user_data must belong to user_id.
+    """
+    credentials = context.user_data.get("credentials")
+    if credentials is None:
+        # None allows everyone; by default nobody but the users listed in DEFAULT_USERS.
+        allowed = context.bot_data["default_users"]
+        if allowed is None or user_id in allowed:
+            return context.bot_data["default_credentials"]
+    return credentials
+
+def user_credentials(update: Update, context: ContextTypes.DEFAULT_TYPE) -> tuple[str, str] | None:
+    return credentials_for(update.effective_user.id, context)
+
+async def current_session(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Session | None:
+    credentials = user_credentials(update, context)
+    if credentials is None:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="Please /login <ghostfolio token> [host] first")
+        return None
+    return context.bot_data["sessions"].get(*credentials)
+
+def allowed_host(host: str, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Whether /login may connect to host: an http(s) URL listed in ALLOWED_HOSTS (any such URL for "*")."""
+    parts = urlsplit(host)
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return False
+    allowed = context.bot_data["allowed_hosts"]
+    return allowed is None or host in allowed
+
+@timed("login")
+async def login(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="Usage: /login <ghostfolio token> [host]")
+        return
+
+    token = context.args[0]
+    host = context.args[1].rstrip("/") if len(context.args) > 1 else context.bot_data["default_host"]
+    try:
+        # Keep the token out of the chat history.
+        await update.message.delete()
+    except TelegramError:
+        pass
+
+    if not allowed_host(host, context):
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Host {host} is not allowed")
+        return
+
+    try:
+        # Checked before a session (and its order and period databases) exists for these credentials.
+        await context.bot_data["sessions"].verify(token, host)
+    except Exception as e:
+        logging.info("Login to %s failed: %s", host, e)
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="Login failed, check the token and host")
+        return
+
+    context.user_data["credentials"] = (token, host)
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Logged in to {host}")
+
+@timed("logout")
+async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop("credentials", None)
+    # Alerts in other chats stop on their next check, once they see the login is gone.
+    book = drop_alerts(context, update.effective_chat.id, update.effective_user.id)
+    text = "Logged out"
+    if book is not None and book.rules:
+        text += f", stopped {len(book.rules)} alert(s)"
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
+
+@timed("accounts")
 async def accounts(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ghost = context.bot_data["ghostfolio"]
-    raw_data = context.bot_data["raw_data"]
-    demo_mode = context.bot_data["demo_mode"]
+    session = await current_session(update, context)
+    if session is None:
+        return ConversationHandler.END
+    raw_data = context.user_data.get("raw_data", False)
+    demo_mode = context.user_data.get("demo_mode", False)
 
-    resp = ghost.accounts()
+    resp = await session.snapshot.get("accounts")
 
     if raw_data:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=json.dumps(resp, indent=2))
+        await send_json(context, update.effective_chat.id, resp, "accounts")
         return
 
     if "accounts" not in resp:
@@ -32,62 +117,60 @@ async def accounts(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     total_value = round(resp["totalValueInBaseCurrency"], 2)
-    txt = ""
-    for info in resp["accounts"]:
-        value_in_base_currency = round(info["valueInBaseCurrency"], 2)
+    lines = []
+    for info in Account.from_list(resp["accounts"]):
+        value_in_base_currency = round(info.value_in_base_currency, 2)
         propotion = round(value_in_base_currency / total_value * 100, 2)
-        value = round(info["value"], 2)
-        currency = info['currency']
+        value = round(info.value, 2)
+        currency = info.currency
 
         if demo_mode:
-            txt += f"{info['name']}: \t\t ***** {currency}\t {propotion} %\n"
+            lines.append(f"{info.name}: \t\t ***** {currency}\t {propotion} %")
         else:
-            txt += f"{info['name']}: \t\t {value} {currency}\t {propotion} %\n"
+            lines.append(f"{info.name}: \t\t {value} {currency}\t {propotion} %")
 
-    txt += "\n"
+    lines.append("")
     if demo_mode:
-        txt += "Total: ***** TWD"
+        lines.append("Total: ***** TWD")
     else:
-        txt += f"Total: {total_value} TWD"
+        lines.append(f"Total: {total_value} TWD")
 
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=txt)
+    await send_text(context, update.effective_chat.id, "\n".join(lines))
 
+@timed("holdings")
 async def holdings(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ghost = context.bot_data["ghostfolio"]
-    raw_data = context.bot_data["raw_data"]
-    demo_mode = context.bot_data["demo_mode"]
-    resp = ghost.holdings()
+    session = await current_session(update, context)
+    if session is None:
+        return ConversationHandler.END
+    raw_data = context.user_data.get("raw_data", False)
+    demo_mode = context.user_data.get("demo_mode", False)
+    resp = await session.snapshot.get("holdings")
     if raw_data:
-        # send resp by chunks
-        for holding in resp["holdings"]:
-            await context.bot.send_message(chat_id=update.effective_chat.id, text=json.dumps(holding, indent=2))
+        await send_json(context, update.effective_chat.id, resp, "holdings")
         return
 
     if "holdings" not in resp:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="Error")
         return
 
-    txt = ""
-    for holding in resp["holdings"]:
+    lines = []
+    for holding in Holding.from_list(resp["holdings"]):
         if demo_mode:
             value = "*****"
             quantity = "*****"
         else:
-            value = round(holding["valueInBaseCurrency"])
-            quantity = holding["quantity"]
+            value = round(holding.value_in_base_currency)
+            quantity = holding.quantity
 
-        txt += f"{holding['name']} ({holding['symbol']}): \n"
-        txt += f"\t\t Quantity: {quantity}\n"
-        txt += f"\t\t Price: {holding['marketPrice']} {holding['currency']}\n"
-        txt += f"\t\t Value: {value} TWD \n"
-        txt += f"\t\t Propotion: {round(holding['allocationInPercentage'] * 100, 2)}% \n"
+        lines.append(f"{holding.name} ({holding.symbol}): ")
+        lines.append(f"\t\t Quantity: {quantity}")
+        lines.append(f"\t\t Price: {holding.market_price} {holding.currency}")
+        lines.append(f"\t\t Value: {value} TWD ")
+        lines.append(f"\t\t Propotion: {round(holding.allocation_in_percentage * 100, 2)}% ")
 
-    if len(txt) > 4096:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="The message is too long")
-        return
-
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=txt)
+    await send_text(context, update.effective_chat.id, "\n".join(lines))
 
+@timed("performance")
 async def select_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("Year to Date", callback_data="ytd"),
@@ -105,66 +188,48 @@ async def select_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('Please choose range:', reply_markup=reply_markup)
     return STAGE1
 
+@timed("performance_callback")
 async def performance_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     data_range = query.data
+    session = await current_session(update, context)
+    if session is None:
+        return ConversationHandler.END
 
-    ghost = context.bot_data["ghostfolio"]
-    raw_data = context.bot_data["raw_data"]
-    demo_mode = context.bot_data["demo_mode"]
+    raw_data = context.user_data.get("raw_data", False)
+    demo_mode = context.user_data.get("demo_mode", False)
 
     if raw_data:
-        context.bot.send_message(chat_id=update.effective_chat.id, text="This command does not support raw data")
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="This command does not support raw data")
 
     try:
-        resp = ghost.performance(data_range)
+        resp = await session.snapshot.get("performance", data_range)
     except Exception as e:
         await context.bot.send_message(chat_id=update.effective_chat.id, text=str(e))
         return
 
-    if "chart" not in resp:
+    if not resp.get("chart"):
         await context.bot.send_message(chat_id=update.effective_chat.id, text="Error")
+        return ConversationHandler.END
 
-    date = [data["date"] for data in resp["chart"]]
-    performance = [data["netPerformanceInPercentage"] for data in resp["chart"]]
-    value = [data["value"] for data in resp["chart"]]
-    value[0] = value[1] if value[0] == 0 else value[0]
-
-    # draw a line chart, performance and value is y-axis, date is x-axis
-    fig, ax = plt.subplots()
-    ax.plot(date, performance, color="tab:blue", label="Performance")
-    ax.set_xlabel("Date")
-    ax.set_ylabel("Performance")
-    ax.legend(loc="upper left")
-    if not demo_mode:
-        ax2 = ax.twinx()
-        ax2.plot(date, value, color="tab:red", label="Value in TWD")
-        ax2.get_yaxis().get_major_formatter().set_scientific(False)
-        ax2.set_ylabel("Value in TWD")
-        ax2.legend(loc="upper right")
-
-    plt.title(f"Performance of {data_range}")
-    plt.tight_layout()
-    plt.savefig("performance.png")
-
-    await context.bot.send_photo(chat_id=update.effective_chat.id, photo=open("performance.png", "rb"))
-
-    plt.close()
+    png = await context.bot_data["charts"].performance(resp["chart"], data_range, demo_mode)
+    await context.bot.send_photo(chat_id=update.effective_chat.id, photo=png)
     return ConversationHandler.END
 
+@timed("position")
 async def select_holding(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not holding_list:
-        ghost = context.bot_data["ghostfolio"]
-        resp = ghost.holdings()
-        if "holdings" not in resp:
-            await context.bot.send_message(chat_id=update.effective_chat.id, text="Error")
-            return
-
-        for holding in resp["holdings"]:
-            if holding.get("symbol", "") not in holding_list:
-                holding_list.append(holding["symbol"])
+    session = await current_session(update, context)
+    if session is None:
+        return ConversationHandler.END
+    registry = session.symbols
+    try:
+        await registry.ensure_loaded()
+    except Exception:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="Error")
+        return
 
+    holding_list = registry.symbols()
     keyboard = []
     for index in range(0, len(holding_list), 3):
         line = []
@@ -179,24 +244,21 @@ async def select_holding(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('Please choose holding:', reply_markup=reply_markup)
     return STAGE1
 
+@timed("position_callback")
 async def position_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     symbol = query.data
+    session = await current_session(update, context)
+    if session is None:
+        return ConversationHandler.END
 
-    ghost = context.bot_data["ghostfolio"]
-    raw_data = context.bot_data["raw_data"]
-    demo_mode = context.bot_data["demo_mode"]
+    raw_data = context.user_data.get("raw_data", False)
+    demo_mode = context.user_data.get("demo_mode", False)
 
-    data_sources = ["YAHOO", "COINGECKO"]
     try:
-        found = False
-        for source in data_sources:
-            resp = ghost.position(source, symbol)
-            if "SymbolProfile" in resp:
-                found = True
-                break
-        if not found:
+        resp = await session.symbols.position(symbol)
+        if "SymbolProfile" not in resp:
             await context.bot.send_message(chat_id=update.effective_chat.id, text="Symbol not found")
             return
     except Exception as e:
@@ -204,73 +266,146 @@ async def position_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if raw_data:
-        resp.pop("orders", None)
-        resp.pop("historicalData", None)
-
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=json.dumps(resp, indent=2))
+        await send_json(context, update.effective_chat.id, resp, symbol)
         return
 
-    txt = ""
-    profile = resp["SymbolProfile"]
-    txt += f"{profile['name']} ({profile['symbol']})\n"
-    txt += f"\t\t Price: {resp['marketPrice']} {profile['currency']}\n"
+    position = Position.from_dict(resp)
+    lines = [
+        f"{position.name} ({position.symbol})",
+        f"\t\t Price: {position.market_price} {position.currency}",
+    ]
     if not demo_mode:
-        txt += f"\t\t Quantity: {resp['quantity']}\n"
-        txt += f"\t\t Cost: {round(resp['investment'], 2)} TWD\n" 
-        txt += f"\t\t Current Value: {round(resp['value'], 2)} TWD\n"
-        txt += f"\t\t Profit: {round(resp['netPerformance'], 2)} TWD\n"
-    profit_percentage = round(resp['netPerformance'] / resp['investment'] * 100, 2)
-    txt += f"\t\t Profit Percentage: {profit_percentage} %\n"
-
-    await query.edit_message_text(text=txt)
+        lines.append(f"\t\t Quantity: {position.quantity}")
+        lines.append(f"\t\t Cost: {round(position.investment, 2)} TWD")
+        lines.append(f"\t\t Current Value: {round(position.value, 2)} TWD")
+        lines.append(f"\t\t Profit: {round(position.net_performance, 2)} TWD")
+    profit_percentage = round(position.net_performance / position.investment * 100, 2)
+    lines.append(f"\t\t Profit Percentage: {profit_percentage} %")
+
+    await query.edit_message_text(text="\n".join(lines))
     return ConversationHandler.END
 
-async def select_broker(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@timed("import")
+async def ask_import_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data["uploads"] = []
+    await update.message.reply_text("Please upload the csv exports of your brokers (or a zip of them), then send /done")
+    return STAGE2
+
+@timed("import_file")
+async def receive_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    uploads = context.user_data.setdefault("uploads", [])
+    size = sum(len(data) for _, data in uploads) + (document.file_size or 0)
+    if len(uploads) >= MAX_UPLOAD_FILES or size > MAX_UPLOAD_BYTES:
+        await update.message.reply_text(f"Upload limit reached ({MAX_UPLOAD_FILES} files, "
+                                        f"{MAX_UPLOAD_BYTES // 2 ** 20} MB), send /done to parse what was received")
+        return STAGE2
+    file = await document.get_file()
+    # Kept in memory until /done; nothing is written to disk.
+    data = bytes(await file.download_as_bytearray())
+    uploads.append((document.file_name or f"upload-{len(uploads) + 1}", data))
+    await update.message.reply_text(f"Received {document.file_name}, upload more files or send /done")
+    return STAGE2
+
+@timed("import_parse")
+async def parse_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uploads = context.user_data.pop("uploads", [])
+    if not uploads:
+        await update.message.reply_text("No files uploaded, import canceled")
+        return ConversationHandler.END
+    session = await current_session(update, context)
+    if session is None:
+        return ConversationHandler.END
+
+    previewed = False
+
+    async def show_first(name, parsed, pending):
+        # Preview the first chunk to finish, also of a single large file, while the rest is still parsing.
+        nonlocal previewed
+        if pending and parsed and not previewed:
+            previewed = True
+            await update.message.reply_text(f"Still parsing, first activities from {name}:\n" + preview(parsed))
+
+    try:
+        with METRICS.timer("import:parse"):
+            # Every CSV is parsed in its own worker process; the stock map is loaded once here.
+            activities, brokers = await parse_uploads(uploads, context.bot_data["import_pool"],
+                                                      chunk_size=context.bot_data["import_chunk_size"],
+                                                      on_parsed=show_first)
+
+        # Skip activities that already exist, e.g. when re-uploading an overlapping export. A full sync,
+        # so orders deleted or edited in Ghostfolio since the last one do not hide activities.
+        store = session.orders
+        await store.sync(session.ghost, full=True)
+        activities, skipped = drop_existing(activities, await asyncio.to_thread(store.keys))
+        context.user_data["activities"] = activities
+    except Exception as e:
+        await update.message.reply_text(f"Error: {e}")
+        return ConversationHandler.END
+
+    found = ", ".join(f"{count} {broker}" for broker, count in brokers.items())
+    if skipped:
+        await update.message.reply_text(f"Parsed {found} file(s), skipped {skipped} activities already in Ghostfolio")
+    else:
+        await update.message.reply_text(f"Parsed {found} file(s)")
+    return await select_import_mode(update, context)
+
+async def import_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    for key in ("uploads", "activities", "cur_activity"):
+        context.user_data.pop(key, None)
+    if update.effective_chat is not None:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="Import timed out, please /import again")
+
+async def select_import_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    activities = context.user_data["activities"]
+    if not activities:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="No activities to import")
+        return ConversationHandler.END
+
     keyboard = [
-        [InlineKeyboardButton("Cathay", callback_data="cathay"),
-         InlineKeyboardButton("Firstrade", callback_data="ft")],
+        [InlineKeyboardButton(f"Import all {len(activities)}", callback_data="all"),
+         InlineKeyboardButton("One by one", callback_data="one"),
+         InlineKeyboardButton("Cancel", callback_data="cancel")],
     ]
 
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await update.message.reply_text('Please choose broker:', reply_markup=reply_markup)
-    return STAGE1
+    await send_text(context, update.effective_chat.id, preview(flatten(activities)), reply_markup=reply_markup)
+    return STAGE3
 
-async def ask_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@timed("import_mode")
+async def import_mode_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    broker = query.data
-    context.bot_data["broker"] = broker
-
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Please upload the csv file of {broker}")
-    return STAGE2
 
-async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    broker = context.bot_data["broker"]
-    if broker not in ["cathay", "ft"]:
-        await update.message.reply_text("Invalid broker")
+    if query.data == "one":
+        return await start_import(update, context)
+    if query.data != "all":
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="Import canceled")
         return ConversationHandler.END
 
-    file = await update.message.document.get_file()
-    csv = await file.download_to_drive("import.csv")
-    try:
-        with open(csv, "r") as f:
-            activities = DataImporter(broker, f).activities()
-            context.bot_data["activities"] = activities
-    except Exception as e:
-        await update.message.reply_text("Error: ", str(e))
+    session = await current_session(update, context)
+    if session is None:
         return ConversationHandler.END
+    ghost = session.ghost
+    activities = flatten(context.user_data.pop("activities"))
+    await query.edit_message_reply_markup(reply_markup=None)
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Importing {len(activities)} activities...")
 
-    await update.message.reply_text("Successfully uploaded the file")
-    return await start_import(update, context)
+    results = await import_in_chunks(ghost, activities, context.bot_data["import_batch_size"])
+    if any(result.ok for result in results):
+        portfolio_changed(session)
+
+    await send_text(context, update.effective_chat.id, report(results))
+    return ConversationHandler.END
 
 async def start_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    activities = context.bot_data["activities"]
+    activities = context.user_data["activities"]
     keyboard = [
         [InlineKeyboardButton("Import", callback_data="import"),
          InlineKeyboardButton("Cancel", callback_data="cancel")],
     ]
     activity = activities.pop(0)
-    context.bot_data["cur_activity"] = activity
+    context.user_data["cur_activity"] = activity
 
     reply_markup = InlineKeyboardMarkup(keyboard)
     await context.bot.send_message(chat_id=update.effective_chat.id,
@@ -278,59 +413,90 @@ async def start_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                    reply_markup=reply_markup)
     return STAGE4
 
+def portfolio_changed(session: Session):
+    """Drop derived state after transactions were imported."""
+    session.symbols.invalidate()
+    session.orders.needs_full_sync = True
+    session.snapshot.invalidate()
+    session.analytics.invalidate()
+    session.periods.invalidate()
+
+@timed("import_confirm")
 async def confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     confirm = query.data == "import"
 
-    ghost = context.bot_data["ghostfolio"]
-    activity = context.bot_data["cur_activity"]
+    session = await current_session(update, context)
+    if session is None:
+        return ConversationHandler.END
+    ghost = session.ghost
+    activity = context.user_data["cur_activity"]
 
     if confirm:
-        ghost.import_transactions(activity)
+        await ghost.import_transactions(activity)
+        portfolio_changed(session)
         await context.bot.send_message(chat_id=update.effective_chat.id, text="Imported successfully with response")
     else:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="Import canceled")
 
-    if context.bot_data["activities"]:
+    if context.user_data["activities"]:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="Continue to import")
         return await start_import(update, context)
     else:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="No more activities to import")
         return ConversationHandler.END
 
+@timed("orders")
 async def order(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ghost = context.bot_data["ghostfolio"]
-    raw_data = context.bot_data["raw_data"]
-    cur_activity = context.bot_data.get("cur_activity", None)
-    if cur_activity is None:
-        cur_activity = 0
-    else:
-        cur_activity += 10
+    session = await current_session(update, context)
+    if session is None:
+        return ConversationHandler.END
+    ghost = session.ghost
+    store = session.orders
+    args = context.args or []
+    # "/orders refresh [search]" resyncs the whole history, picking up edits and deletions made in Ghostfolio.
+    refresh = args[:1] == ["refresh"]
+    if refresh:
+        args = args[1:]
+    context.user_data["orders_search"] = " ".join(args) or None
+    context.user_data["orders_cursor"] = None
 
     try:
-        resp = ghost.orders(skip=cur_activity)
-        context.bot_data["cur_activity"] = cur_activity
+        await store.sync(ghost, full=refresh)
     except Exception as e:
         await context.bot.send_message(chat_id=update.effective_chat.id, text=str(e))
-        return
+        return ConversationHandler.END
 
-    if raw_data:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=json.dumps(resp, indent=2))
-        return
+    return await send_orders_page(update, context, session)
+
+async def send_orders_page(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session):
+    raw_data = context.user_data.get("raw_data", False)
+    activities, cursor = session.orders.page(
+        context.user_data["orders_cursor"], search=context.user_data["orders_search"]
+    )
+    context.user_data["orders_cursor"] = cursor
 
-    if "activities" not in resp:
-        await context.bot.send_message(chat_id=update.effective_chat.id, text="Error Resp: {}".format(resp))
+    if not activities:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="No activities found")
+        return ConversationHandler.END
 
-    txt = ""
-    for activity in resp["activities"]:
-        symbol_profile = activity["SymbolProfile"]
-        account_info = activity["Account"]
-        date = activity["date"].split("T")[0]
-        txt += "{} {} {} at {} \n".format(activity["type"], activity["quantity"], symbol_profile["symbol"], date)
-        txt += "\t with price {} {} in account {} \n".format(activity["unitPrice"], symbol_profile["currency"], account_info["name"])
+    if raw_data:
+        await send_json(context, update.effective_chat.id, activities, "orders")
+    else:
+        lines = []
+        for activity in activities:
+            symbol_profile = activity["SymbolProfile"]
+            account_info = activity["Account"]
+            date = activity["date"].split("T")[0]
+            lines.append("{} {} {} at {} ".format(activity["type"], activity["quantity"], symbol_profile["symbol"], date))
+            lines.append("\t with price {} {} in account {} ".format(activity["unitPrice"], symbol_profile["currency"], account_info["name"]))
+        await send_text(context, update.effective_chat.id, "\n".join(lines))
+
+    if cursor is None:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="End of activities")
+        return ConversationHandler.END
 
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=txt)
     keyboard = [
         [InlineKeyboardButton("Yes", callback_data="yes"),
          InlineKeyboardButton("No", callback_data="no")]
@@ -340,43 +506,303 @@ async def order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(chat_id=update.effective_chat.id, text='More activities ?', reply_markup=reply_markup)
     return STAGE1
 
+@timed("orders_more")
 async def order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     more = query.data == "yes"
 
     if more:
-        return await order(update, context)
+        session = await current_session(update, context)
+        if session is None:
+            return ConversationHandler.END
+        return await send_orders_page(update, context, session)
     else:
-        context.bot_data.pop("cur_activity", None)
+        context.user_data.pop("orders_cursor", None)
+        context.user_data.pop("orders_search", None)
         await context.bot.send_message(chat_id=update.effective_chat.id, text="End of activities")
         return ConversationHandler.END
 
+async def send_period_totals(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str):
+    """/dividends or /investments [month|quarter|year], from the session's local period store."""
+    session = await current_session(update, context)
+    if session is None:
+        return
+
+    by = context.args[0] if context.args else "year"
+    if by not in ROLLUPS:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Usage: /{kind} [{'|'.join(ROLLUPS)}]")
+        return
+
+    raw_data = context.user_data.get("raw_data", False)
+    demo_mode = context.user_data.get("demo_mode", False)
+    store = session.periods
+    try:
+        await store.sync(session.ghost, kind)
+    except Exception as e:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Error: {e}")
+        return
+
+    labels, amounts = await asyncio.to_thread(store.totals, kind, by)
+    if not labels:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"No {kind} found")
+        return
+
+    if raw_data:
+        await send_json(context, update.effective_chat.id, dict(zip(labels, amounts.tolist())), kind)
+        return
+
+    if demo_mode:
+        total = amounts.sum()
+        lines = [f"{label}: {amount / total * 100:.2f} %" if total else f"{label}: -"
+                 for label, amount in zip(labels, amounts)]
+    else:
+        lines = [f"{label}: {round(amount, 2)} TWD" for label, amount in zip(labels, amounts)]
+        lines.append("")
+        lines.append(f"Total: {round(amounts.sum(), 2)} TWD")
+    await send_text(context, update.effective_chat.id, "\n".join(lines))
+
+    png = await context.bot_data["charts"].bars(labels, amounts, f"{kind.capitalize()} per {by}", demo_mode)
+    await context.bot.send_photo(chat_id=update.effective_chat.id, photo=png)
+
+@timed("dividends")
+async def dividends(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_period_totals(update, context, "dividends")
+
+@timed("investments")
+async def investments(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_period_totals(update, context, "investments")
+
+def percent(value: float) -> str:
+    return "n/a" if value != value else f"{value * 100:.2f}%"
+
+@timed("analytics")
+async def analytics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    session = await current_session(update, context)
+    if session is None:
+        return
+
+    raw_data = context.user_data.get("raw_data", False)
+    demo_mode = context.user_data.get("demo_mode", False)
+    # /analytics [range ...]: the first range also selects the contribution breakdown.
+    ranges = tuple(context.args) or DEFAULT_RANGES
+    try:
+        resp = await session.analytics.report(ranges, contribution_range=context.args[0] if context.args else "1y")
+    except Exception as e:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Error: {e}")
+        return
+
+    if raw_data:
+        await send_json(context, update.effective_chat.id, resp, "analytics")
+        return
+
+    currency = resp["currency"]
+    lines = []
+    for metrics in resp["ranges"]:
+        lines.append(f"{metrics['range']} ({metrics['start']} - {metrics['end']})")
+        lines.append(f"\t\t TWR: {percent(metrics['twr'])}  XIRR: {percent(metrics['xirr'])}")
+        lines.append(f"\t\t Max drawdown: {percent(metrics['max_drawdown'])}  Volatility: {percent(metrics['volatility'])}")
+        if not demo_mode:
+            lines.append(f"\t\t Profit: {round(metrics['profit'], 2)} {currency}")
+
+    contributions = resp["contributions"]
+    total = sum(profit for _, profit in contributions)
+    lines.append("")
+    lines.append(f"Contribution ({resp['contribution_range']}):")
+    for symbol, profit in contributions:
+        share = f"{profit / total * 100:.1f}%" if total else "-"
+        if demo_mode:
+            lines.append(f"\t\t {symbol}: {share}")
+        else:
+            lines.append(f"\t\t {symbol}: {round(profit, 2)} {currency} ({share})")
+    if resp["excluded"]:
+        lines.append("")
+        lines.append(f"Excluded, no {currency} exchange rate: {', '.join(resp['excluded'])}")
+
+    await send_text(context, update.effective_chat.id, "\n".join(lines))
+
+ALERT_USAGE = """Usage:
+/alert move <symbol|*> <percent> - price moved by percent since the last alert
+/alert drift <symbol> <target %> <tolerance %> - allocation left or returned to target
+/alert interval <minutes> - at most a week
+/alert list
+/alert clear"""
+
+def alert_minutes(seconds: int) -> str:
+    return f"{seconds / 60:g} minute{'' if seconds == 60 else 's'}"
+
+def schedule_alerts(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, book: AlertBook | None):
+    for job in context.job_queue.get_jobs_by_name(f"alerts:{chat_id}:{user_id}"):
+        job.schedule_removal()
+    if book is not None and book.rules:
+        context.job_queue.run_repeating(check_alerts, interval=book.interval, first=book.interval,
+                                        chat_id=chat_id, user_id=user_id, name=f"alerts:{chat_id}:{user_id}")
+
+def drop_alerts(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int) -> AlertBook | None:
+    book = context.chat_data.get("alerts", {}).pop(user_id, None)
+    schedule_alerts(context, chat_id, user_id, None)
+    return book
+
+async def check_alerts(context: ContextTypes.DEFAULT_TYPE):
+    """Job: one batched quote refresh per tick for all rules a user set in a chat; only changes are sent."""
+    chat_id, user_id = context.job.chat_id, context.job.user_id
+    book = context.chat_data.get("alerts", {}).get(user_id)
+    if book is None or not book.rules:
+        context.job.schedule_removal()
+        return
+    if credentials_for(user_id, context) != book.credentials:
+        # Logged out (or in to another portfolio) since the rules were set up.
+        drop_alerts(context, chat_id, user_id)
+        await context.bot.send_message(chat_id=chat_id,
+                                       text=f"Stopped {len(book.rules)} alert(s), their login is no longer active")
+        return
+
+    with METRICS.timer("job:alerts"):
+        messages = await book.check(context.bot_data["sessions"].get(*book.credentials).ghost)
+    if messages:
+        await send_text(context, chat_id, "\n".join(messages))
+
+def parse_bounded(value: str, high: float) -> float:
+    """A number in (0, high]; NaN, infinities and out of range values raise ValueError."""
+    number = float(value)
+    if not 0 < number <= high:
+        raise ValueError(f"{value} is not in (0, {high:g}]")
+    return number
+
+def parse_alert_rule(args: list[str]) -> dict:
+    if args[0] == "move" and len(args) == 3:
+        return {"kind": "move", "symbol": args[1], "threshold": parse_bounded(args[2], 1000) / 100}
+    if args[0] == "drift" and len(args) == 4:
+        return {"kind": "drift", "symbol": args[1], "target": parse_bounded(args[2], 100) / 100,
+                "tolerance": parse_bounded(args[3], 100) / 100}
+    raise ValueError
+
+@timed("alert")
+async def alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id, user_id = update.effective_chat.id, update.effective_user.id
+    args = context.args or []
+    # Every user has their own rules in a chat, watching their own portfolio.
+    books = context.chat_data.setdefault("alerts", {})
+    book = books.get(user_id)
+    try:
+        if args and args[0] in ("move", "drift"):
+            credentials = user_credentials(update, context)
+            if credentials is None:
+                await context.bot.send_message(chat_id=chat_id, text="Please /login <ghostfolio token> [host] first")
+                return
+            rule = parse_alert_rule(args)
+            text = ""
+            if book is None or book.credentials != credentials:
+                if book is not None and book.rules:
+                    text = f"Dropped {len(book.rules)} alert(s) set up for another login\n"
+                book = books[user_id] = AlertBook(credentials)
+            book.add(rule)
+            schedule_alerts(context, chat_id, user_id, book)
+            text += f"Alert added, checking every {alert_minutes(book.interval)}"
+        elif args[:1] == ["interval"] and len(args) == 2 and book is not None:
+            book.interval = max(round(parse_bounded(args[1], MAX_ALERT_INTERVAL / 60) * 60), MIN_ALERT_INTERVAL)
+            schedule_alerts(context, chat_id, user_id, book)
+            text = f"Checking alerts every {alert_minutes(book.interval)}"
+        elif args[:1] == ["list"]:
+            rules = book.rules if book is not None else []
+            text = "\n".join(
+                f"{i + 1}. {rule['kind']} {rule['symbol']} " + (
+                    f"{rule['threshold'] * 100:g}%" if rule["kind"] == "move"
+                    else f"{rule['target'] * 100:g}% ± {rule['tolerance'] * 100:g}%"
+                )
+                for i, rule in enumerate(rules)
+            ) or "No alerts"
+        elif args[:1] == ["clear"]:
+            if book is not None:
+                book.clear()
+                schedule_alerts(context, chat_id, user_id, book)
+            text = "Alerts cleared"
+        else:
+            raise ValueError
+    except (ValueError, OverflowError):
+        text = ALERT_USAGE
+
+    await context.bot.send_message(chat_id=chat_id, text=text)
+
+@timed("raw_data")
 async def toggle_raw_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.bot_data["raw_data"] = not context.bot_data["raw_data"]
-    txt = "Raw data is now enabled" if context.bot_data["raw_data"] else "Raw data is now disabled"
+    context.user_data["raw_data"] = not context.user_data.get("raw_data", False)
+    txt = "Raw data is now enabled" if context.user_data["raw_data"] else "Raw data is now disabled"
     await context.bot.send_message(chat_id=update.effective_chat.id, text=txt)
 
+@timed("demo_mode")
 async def toggle_demo_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.bot_data["demo_mode"] = not context.bot_data["demo_mode"]
-    txt = "Demo mode is now enabled" if context.bot_data["demo_mode"] else "Demo mode is now disabled"
+    context.user_data["demo_mode"] = not context.user_data.get("demo_mode", False)
+    txt = "Demo mode is now enabled" if context.user_data["demo_mode"] else "Demo mode is now disabled"
     await context.bot.send_message(chat_id=update.effective_chat.id, text=txt)
 
+@timed("stats")
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await send_text(context, update.effective_chat.id, METRICS.report())
+
+async def start_metrics_server(application):
+    port = os.getenv("METRICS_PORT")
+    if port:
+        application.bot_data["metrics_server"] = await METRICS.serve_prometheus(os.getenv("METRICS_HOST", "0.0.0.0"), int(port))
+
+async def refresh_snapshot(context: ContextTypes.DEFAULT_TYPE):
+    await context.bot_data["sessions"].refresh_all()
+
+async def shutdown(application):
+    if "metrics_server" in application.bot_data:
+        application.bot_data["metrics_server"].close()
+    await application.bot_data["sessions"].close()
+    application.bot_data["charts"].close()
+    application.bot_data["import_pool"].shutdown(cancel_futures=True)
+
+@timed("unknown")
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(chat_id=update.effective_chat.id, text="Unknown Command")
 
 if __name__ == '__main__':
     bot_token = os.getenv("BOT_TOKEN")
-    host = os.getenv("HOST")
+    host = os.getenv("HOST", "https://ghostfol.io").rstrip("/")
     ghostfolio_token = os.getenv("GHOSTFOLIO_TOKEN")
 
-    application = ApplicationBuilder().token(bot_token).build()
-
-    ghost = Ghostfolio(token=ghostfolio_token, host=host)
+    # AIORateLimiter queues outgoing requests within Telegram's flood limits and retries on RetryAfter.
+    # Updates are handled concurrently, but in order per user and chat so conversations stay consistent.
+    update_processor = PerChatUpdateProcessor(int(os.getenv("CONCURRENT_UPDATES", DEFAULT_CONCURRENT_UPDATES)))
+    application = (
+        ApplicationBuilder().token(bot_token)
+        .rate_limiter(AIORateLimiter(max_retries=3))
+        .concurrent_updates(update_processor)
+        .post_init(start_metrics_server)
+        .post_shutdown(shutdown)
+        .build()
+    )
 
-    application.bot_data["ghostfolio"] = ghost
-    application.bot_data["raw_data"] = False
-    application.bot_data["demo_mode"] = False
+    # One session per Ghostfolio login; users without their own /login share GHOSTFOLIO_TOKEN, if set.
+    sessions = SessionPool(max_sessions=int(os.getenv("MAX_SESSIONS", 500)),
+                           snapshot_max_age=int(os.getenv("SNAPSHOT_MAX_AGE", 60)))
+    sessions.on_request = lambda name, seconds, failed: METRICS.observe(f"ghostfolio:{name}", seconds, failed)
+
+    application.bot_data["sessions"] = sessions
+    application.bot_data["default_host"] = host
+    # Hosts /login may connect to, so users cannot make the bot probe other services; "*" allows any.
+    allowed_hosts = os.getenv("ALLOWED_HOSTS", host)
+    application.bot_data["allowed_hosts"] = None if allowed_hosts.strip() == "*" else {
+        allowed.strip().rstrip("/") for allowed in allowed_hosts.split(",") if allowed.strip()
+    }
+    application.bot_data["default_credentials"] = (ghostfolio_token, host) if ghostfolio_token else None
+    # Telegram user ids allowed to use GHOSTFOLIO_TOKEN without their own /login, or "*" for anyone.
+    default_users = os.getenv("DEFAULT_USERS", "")
+    application.bot_data["default_users"] = None if default_users.strip() == "*" else {
+        int(user_id) for user_id in default_users.split(",") if user_id.strip()
+    }
+    application.bot_data["charts"] = ChartRenderer()
+    METRICS.register_cache("responses", sessions.cache)
+    METRICS.register_cache("charts", application.bot_data["charts"].cache)
+    METRICS.register_counters("ghostfolio", sessions.metrics)
+    application.job_queue.run_repeating(refresh_snapshot, interval=int(os.getenv("SNAPSHOT_INTERVAL", 300)), first=0)
+    application.bot_data["import_batch_size"] = int(os.getenv("IMPORT_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+    application.bot_data["import_chunk_size"] = int(os.getenv("IMPORT_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+    application.bot_data["import_pool"] = ProcessPoolExecutor(max_workers=int(os.getenv("IMPORT_WORKERS", 2)),
+                                                              mp_context=multiprocessing.get_context("spawn"))
 
     performance_handler = ConversationHandler(
         entry_points=[CommandHandler('performance', select_range)],
@@ -395,13 +821,18 @@ if __name__ == '__main__':
     )
 
     import_handler = ConversationHandler(
-        entry_points=[CommandHandler('import', select_broker)],
+        entry_points=[CommandHandler('import', ask_import_files)],
         states={
-            STAGE1: [CallbackQueryHandler(ask_import_file)],
-            STAGE2: [MessageHandler(filters.Document.MimeType("text/csv"), handle_file)],
+            STAGE2: [MessageHandler(filters.Document.MimeType("text/csv") | filters.Document.FileExtension("csv")
+                                    | filters.Document.ZIP, receive_file),
+                     CommandHandler('done', parse_files)],
+            STAGE3: [CallbackQueryHandler(import_mode_callback)],
             STAGE4: [CallbackQueryHandler(confirm_callback)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, import_timeout)],
         },
-        fallbacks=[CommandHandler('import', select_broker)],
+        fallbacks=[CommandHandler('import', ask_import_files)],
+        # Uploads and parsed activities are held in memory, so abandoned imports must not linger.
+        conversation_timeout=int(os.getenv("IMPORT_TIMEOUT", 600)),
     )
 
     order_handler = ConversationHandler(
@@ -419,11 +850,31 @@ if __name__ == '__main__':
     application.add_handler(import_handler)
     application.add_handler(performance_handler)
     application.add_handler(order_handler)
+    application.add_handler(CommandHandler('analytics', analytics))
+    application.add_handler(CommandHandler('dividends', dividends))
+    application.add_handler(CommandHandler('investments', investments))
+    application.add_handler(CommandHandler('alert', alert))
 
     # Settings
+    application.add_handler(CommandHandler('login', login))
+    application.add_handler(CommandHandler('logout', logout))
     application.add_handler(CommandHandler('raw_data', toggle_raw_data))
     application.add_handler(CommandHandler('demo_mode', toggle_demo_mode))
+    application.add_handler(CommandHandler('stats', stats))
 
     # Unknown
     application.add_handler(MessageHandler(filters.COMMAND, unknown))
-    application.run_polling()
+
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if webhook_url:
+        # Telegram pushes updates to WEBHOOK_URL; a reverse proxy forwards them to WEBHOOK_LISTEN:WEBHOOK_PORT.
+        application.run_webhook(
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", 8443)),
+            url_path=urlsplit(webhook_url).path.lstrip("/"),
+            webhook_url=webhook_url,
+            secret_token=os.getenv("WEBHOOK_SECRET"),
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40)),
+        )
+    else:
+        application.run_polling()
@@ -0,0 +1,76 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+DEFAULT_CONCURRENT_UPDATES = 32
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process up to ``max_concurrent_updates`` updates at once, one at a time per user and chat.
+
+    Updates from different users and chats run concurrently, while updates from
+    the same user or chat keep their order, so a ConversationHandler step (and
+    the user_data it reads) always sees the effect of the previous one. Waiting
+    updates do not occupy one of the concurrency slots.
+    """
+
+    __slots__ = ("_locks",)
+
+    def __init__(self, max_concurrent_updates: int = DEFAULT_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._locks: dict[tuple, list] = {}
+
+    @staticmethod
+    def _keys(update: object) -> list[tuple]:
+        if not isinstance(update, Update):
+            return []
+        keys = []
+        # Always user before chat, so two updates can never wait on each other.
+        if update.effective_user is not None:
+            keys.append(("user", update.effective_user.id))
+        if update.effective_chat is not None:
+            keys.append(("chat", update.effective_chat.id))
+        return keys
+
+    async def _acquire(self, key: tuple):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._release(key, locked=False)
+            raise
+
+    def _release(self, key: tuple, locked: bool = True):
+        entry = self._locks[key]
+        if locked:
+            entry[0].release()
+        entry[1] -= 1
+        if not entry[1]:
+            del self._locks[key]
+
+    async def process_update(self, update: object, coroutine) -> None:
+        acquired = []
+        try:
+            for key in self._keys(update):
+                try:
+                    await self._acquire(key)
+                except BaseException:
+                    coroutine.close()
+                    raise
+                acquired.append(key)
+            await super().process_update(update, coroutine)
+        finally:
+            for key in reversed(acquired):
+                self._release(key)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass